@@ -0,0 +1,118 @@
+# On-disk cache of parsed articles for the read endpoint, with TTL, LRU eviction and HTTP validators.
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import NamedTuple, Optional
+from canonical import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+class CachedArticle(NamedTuple):
+    article: str  # ArticleData serialised as JSON
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+def cache_key(url: str) -> str:
+    return canonicalize_url(url)
+
+class ArticleCache:
+    def __init__(self, path: str, ttl: float = 3600.0, max_entries: int = 10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.counters = {"hits": 0, "misses": 0, "revalidations": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS articles (
+                url TEXT NOT NULL,
+                engine TEXT NOT NULL,
+                article TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (url, engine)
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS articles_accessed_at ON articles (accessed_at)")
+        self._db.commit()
+        logger.info(f"Article cache opened at {path} (ttl={ttl}s, max_entries={max_entries})")
+
+    def get(self, url: str, engine: str) -> Optional[CachedArticle]:
+        key = cache_key(url)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT article, etag, last_modified, stored_at FROM articles WHERE url = ? AND engine = ?",
+                (key, engine)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE articles SET accessed_at = ? WHERE url = ? AND engine = ?", (time.time(), key, engine))
+            self._db.commit()
+        return CachedArticle(*row)
+
+    def is_fresh(self, entry: CachedArticle) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+    def put(self, url: str, engine: str, article: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO articles (url, engine, article, etag, last_modified, stored_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cache_key(url), engine, article, etag, last_modified, now, now)
+            )
+            self.counters["stores"] += 1
+            self._evict()
+            self._db.commit()
+
+    def touch(self, url: str, engine: str):
+        """Mark an entry fresh again after the origin confirmed it has not changed."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE articles SET stored_at = ?, accessed_at = ? WHERE url = ? AND engine = ?",
+                (now, now, cache_key(url), engine)
+            )
+            self._db.commit()
+
+    def record(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+            stats = dict(self.counters, entries=entries)
+        lookups = stats["hits"] + stats["misses"] + stats["revalidations"]
+        stats["hit_rate"] = (stats["hits"] + stats["revalidations"]) / lookups if lookups else 0.0
+        return stats
+
+    def _evict(self):
+        count = self._db.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM articles WHERE rowid IN (SELECT rowid FROM articles ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,)
+            )
+            self.counters["evictions"] += excess
+
+_article_cache: Optional[ArticleCache] = None
+
+def get_article_cache() -> Optional[ArticleCache]:
+    """Process-wide cache configured from the environment; None when ARTICLE_CACHE_ENABLED=0."""
+    global _article_cache
+    if os.getenv("ARTICLE_CACHE_ENABLED", "1") == "0":
+        return None
+    if _article_cache is None:
+        _article_cache = ArticleCache(
+            path=os.getenv("ARTICLE_CACHE_PATH", "/tmp/attn_article_cache.sqlite3"),
+            ttl=float(os.getenv("ARTICLE_CACHE_TTL", 3600)),
+            max_entries=int(os.getenv("ARTICLE_CACHE_MAX_ENTRIES", 10000))
+        )
+    return _article_cache
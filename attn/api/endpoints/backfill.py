@@ -0,0 +1,50 @@
+# Overnight backfill: score articles or extract their structure through the Message Batches API.
+# Usage: python backfill.py articles.jsonl --task score --out scores.jsonl [--poll 30]
+# Each input line is an ArticleData JSON object, e.g. the "article" field of read job results.
+# To try the whole flow offline, start fake_anthropic.py and set ANTHROPIC_BASE_URL=http://127.0.0.1:8765
+# (and SCHEMA_PATH=schema.json when running outside the container).
+import os
+import sys
+import json
+import asyncio
+import argparse
+import logging
+
+# llm_handler imports its siblings as endpoints.*, so the api directory has to be importable too
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logger = logging.getLogger(__name__)
+
+def load_articles(path: str):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+async def backfill(task: str, articles: list, model_name: str):
+    if task == "score":
+        from score import ScoreRequest, score_articles_offline
+        results = await score_articles_offline(ScoreRequest(articles=articles), model_name=model_name)
+        return [result.dict() for result in results]
+    from extract import ExtractRequest, UserProfile, extract_structure_offline
+    return await extract_structure_offline(ExtractRequest(articles=articles, user_profile=UserProfile()), model_name=model_name)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("articles", help="JSONL file of ArticleData")
+    parser.add_argument("--task", choices=["score", "structure"], default="score")
+    parser.add_argument("--out", required=True, help="JSONL file to write results to")
+    parser.add_argument("--model", default="claude-3-haiku-20240307")
+    parser.add_argument("--poll", type=float, help="Seconds between batch status checks")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.poll is not None:
+        os.environ["LLM_BATCH_POLL_INTERVAL"] = str(args.poll)
+
+    articles = load_articles(args.articles)
+    results = asyncio.run(backfill(args.task, articles, args.model))
+    with open(args.out, "w") as file:
+        for result in results:
+            file.write(json.dumps(result, default=str) + "\n")
+    logger.info(f"Wrote {len(results)} of {len(articles)} results to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Offline bulk LLM calls through the Message Batches API, for backfills that can wait for results.
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# The API accepts up to 100,000 requests per batch; smaller batches finish and fail independently
+BATCH_MAX_REQUESTS = int(os.getenv("LLM_BATCH_MAX_REQUESTS", 10000))
+BATCH_POLL_INTERVAL = float(os.getenv("LLM_BATCH_POLL_INTERVAL", 30))
+BATCH_TIMEOUT = float(os.getenv("LLM_BATCH_TIMEOUT", 24 * 3600))
+
+def custom_id(index: int) -> str:
+    # custom_id must match ^[a-zA-Z0-9_-]{1,64}$, so URLs can't be used directly
+    return f"item-{index}"
+
+def index_of(custom_id: str) -> int:
+    return int(custom_id.rsplit("-", 1)[1])
+
+async def submit(client, requests: List[dict]) -> str:
+    batch = await client.messages.batches.create(requests=requests)
+    logger.info(f"Submitted message batch {batch.id} with {len(requests)} requests")
+    return batch.id
+
+async def wait(client, batch_id: str, poll_interval: float = BATCH_POLL_INTERVAL, timeout: float = BATCH_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while True:
+        batch = await client.messages.batches.retrieve(batch_id)
+        if batch.processing_status == "ended":
+            logger.info(f"Message batch {batch_id} ended: {batch.request_counts}")
+            return batch
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Message batch {batch_id} still {batch.processing_status} after {timeout}s")
+        logger.info(f"Message batch {batch_id} is {batch.processing_status}: {batch.request_counts}")
+        await asyncio.sleep(poll_interval)
+
+async def run_tool_batch(handler, function_name: str, request, items: Dict[str, dict], model_name: Optional[str] = None,
+                         max_tokens: Optional[int] = None, poll_interval: float = BATCH_POLL_INTERVAL) -> Dict[str, Optional[object]]:
+    """One forced tool call per item through Message Batches; returns validated outputs under the items' keys (URLs).
+
+    `items` maps each key to the prompt fields for that item. Keys whose request errored, expired
+    or came back with invalid tool input map to None.
+    """
+    keys = list(items)
+    requests = [
+        {"custom_id": custom_id(index), "params": handler.tool_request(function_name, request, model_name, max_tokens, **items[key])}
+        for index, key in enumerate(keys)
+    ]
+    client = handler.async_client
+    batch_ids = [
+        await submit(client, requests[start:start + BATCH_MAX_REQUESTS])
+        for start in range(0, len(requests), BATCH_MAX_REQUESTS)
+    ]
+    await asyncio.gather(*(wait(client, batch_id, poll_interval) for batch_id in batch_ids))
+
+    outputs: Dict[str, Optional[object]] = {key: None for key in keys}
+    for batch_id in batch_ids:
+        async for entry in await client.messages.batches.results(batch_id):
+            key = keys[index_of(entry.custom_id)]
+            if entry.result.type != "succeeded":
+                logger.error(f"Batched {function_name} request for {key} {entry.result.type}")
+                continue
+            try:
+                outputs[key] = handler.parse_tool_output(function_name, entry.result.message)
+            except Exception as e:
+                logger.error(f"Batched {function_name} output for {key} rejected: {str(e)}")
+    succeeded = sum(output is not None for output in outputs.values())
+    logger.info(f"Batched {function_name}: {succeeded}/{len(keys)} succeeded")
+    return outputs
@@ -0,0 +1,72 @@
+# Packing several articles into one LLM call and matching the per-article results back up.
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, TypeVar
+from canonical import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+ARTICLE_FIELDS = ("url", "title", "keywords", "description", "content")
+# Labels that aren't just the capitalized field name; "URL:" is how the single-article prompts show it too
+FIELD_LABELS = {"url": "URL"}
+
+def pack_batches(items: Iterable[T], size_of: Callable[[T], int], budget: int, max_items: int = 10) -> List[List[T]]:
+    """Greedy and order-preserving: a new batch starts when the next item would overflow the budget or the item cap.
+
+    An item bigger than the whole budget ends up in a batch of its own.
+    """
+    batches: List[List[T]] = []
+    current: List[T] = []
+    used = 0
+    for item in items:
+        size = size_of(item)
+        if current and (used + size > budget or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += size
+    if current:
+        batches.append(current)
+    return batches
+
+def render_articles(articles: Sequence, fields: Sequence[str] = ARTICLE_FIELDS) -> str:
+    blocks = []
+    for number, article in enumerate(articles, 1):
+        lines = [f'<article index="{number}">']
+        for field in fields:
+            value = getattr(article, field)
+            if isinstance(value, list):
+                value = ",".join(value)
+            lines.append(f"{FIELD_LABELS.get(field, field.replace('_', ' ').capitalize())}: {value}")
+        lines.append("</article>")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+def results_by_url(results: Iterable[T], url_of: Callable[[T], str] = lambda result: result.url) -> Dict[str, T]:
+    """Index batch results by canonical URL so small differences in how the model echoes a URL don't matter."""
+    indexed = {}
+    for result in results:
+        key = canonicalize_url(url_of(result))
+        if key in indexed:
+            logger.warning(f"Batch returned more than one result for {url_of(result)}; keeping the first")
+            continue
+        indexed[key] = result
+    return indexed
+
+def require_results(articles: Sequence, check: Optional[Callable[[T], Optional[str]]] = None) -> Callable:
+    """acall_tool validator for batch outputs: raises ValueError naming the articles without a usable result.
+
+    `check(result)` returns why one article's result is unusable, or None. Outputs it rejects get
+    the repair turn and are never cached.
+    """
+    def validate(output):
+        indexed = results_by_url(output.results)
+        missing = []
+        for article in articles:
+            result = indexed.get(canonicalize_url(article.url))
+            if result is None or (check is not None and check(result) is not None):
+                missing.append(article.url)
+        if missing:
+            raise ValueError(f"No usable result for {len(missing)} of {len(articles)} articles: {', '.join(missing)}")
+    return validate
@@ -0,0 +1,82 @@
+# Benchmark: full BeautifulSoup metadata parsing vs the streaming head-only extractor.
+# Usage: python bench_head_meta.py [--corpus DIR_OF_SAVED_HTML] [--chunk-kb 16] [--repeat 3]
+# Without --corpus, a few synthetic article pages of increasing size are generated.
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from bs4 import BeautifulSoup
+from head_meta import stream_head_metadata
+
+def bs4_metadata(html: str) -> dict:
+    # The extraction fetch_metadata used before head_meta, kept here as the reference
+    soup = BeautifulSoup(html, 'lxml')
+    title_tag = soup.find('title')
+    title = title_tag.text if title_tag else 'No title found'
+    meta_description = soup.find('meta', attrs={'name': 'description', 'content': True})
+    description = meta_description['content'].strip() if meta_description else 'No description found'
+    if description == 'No description found':
+        og_description = soup.find('meta', attrs={'property': 'og:description', 'content': True})
+        description = og_description['content'].strip() if og_description else description
+    meta_keywords = soup.find('meta', attrs={'name': 'keywords', 'content': True})
+    keywords = meta_keywords['content'].split(',') if meta_keywords and meta_keywords['content'] else []
+    return {'title': title, 'description': description, 'keywords': keywords}
+
+def synthetic_corpus():
+    head = (
+        '<!doctype html><html lang="en"><head><meta charset="utf-8"><title>Synthetic article {n}</title>'
+        '<meta name="description" content="A synthetic page for benchmarking.">'
+        '<meta name="keywords" content="bench,html,metadata">'
+        '<meta property="og:title" content="Synthetic article {n}">'
+        '<meta property="article:published_time" content="2024-05-13T11:00:00Z">'
+        '<link rel="canonical" href="https://example.com/articles/{n}">'
+        '<script>window.dataLayer = [];</script></head><body>'
+    )
+    block = '<div class="para"><p>Lorem ipsum <a href="/x">dolor</a> sit amet, consectetur adipiscing elit.</p></div>\n'
+    for n, size_kb in enumerate([50, 250, 1000, 4000]):
+        yield f"synthetic-{size_kb}kb", head.format(n=n) + block * (size_kb * 1024 // len(block)) + "</body></html>"
+
+def load_corpus(directory: str):
+    for path in sorted(Path(directory).glob("*.htm*")):
+        yield path.name, path.read_text(encoding="utf-8", errors="replace")
+
+async def chunked(payload: bytes, chunk_size: int):
+    for start in range(0, len(payload), chunk_size):
+        yield payload[start:start + chunk_size]
+
+def best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="Directory of saved .html pages")
+    parser.add_argument("--chunk-kb", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    chunk_size = args.chunk_kb * 1024
+    total_old = total_new = 0.0
+    print(f"{'page':<32} {'size':>9} {'read':>9} {'bs4 (ms)':>9} {'head (ms)':>10} {'match':>6}")
+    for name, html in pages:
+        payload = html.encode("utf-8")
+        head = lambda: asyncio.run(stream_head_metadata(chunked(payload, chunk_size)))
+        old_result = bs4_metadata(html)
+        new_result, bytes_read = head()
+        match = all(old_result[key] == new_result[key] for key in ('description', 'keywords')) \
+            and old_result['title'].strip() == new_result['title']
+        old = best_of(args.repeat, lambda: bs4_metadata(html))
+        new = best_of(args.repeat, head)
+        total_old += old
+        total_new += new
+        print(f"{name[:32]:<32} {len(payload) // 1024:>7}KB {bytes_read // 1024:>7}KB {old * 1000:>9.1f} {new * 1000:>10.1f} {str(match):>6}")
+    if total_new:
+        print(f"total: bs4 {total_old * 1000:.1f}ms, head-only {total_new * 1000:.1f}ms ({total_old / total_new:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Benchmark: line-concatenation reader parsing vs the incremental SSE parser on multi-MB pages.
+# Usage: python bench_sse.py [--sizes 1 4 16] [--chunk-kb 16] [--repeat 3]
+import argparse
+import asyncio
+import json
+import time
+from sse import iter_sse_events
+
+def build_stream(size_mb: int) -> bytes:
+    """A reader-style stream: one large content event followed by a few trailing events."""
+    paragraph = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20 + "\n\n"
+    content = paragraph * (size_mb * 1024 * 1024 // len(paragraph) + 1)
+    first = json.dumps({"title": "Benchmark", "url": "https://example.com", "content": content})
+    trailing = "".join(f"event: progress\ndata: {json.dumps({'step': i})}\n\n" for i in range(5))
+    return f"event: data\ndata: {first}\n\n{trailing}".encode()
+
+async def chunked(payload: bytes, chunk_size: int):
+    for start in range(0, len(payload), chunk_size):
+        yield payload[start:start + chunk_size]
+
+async def legacy(payload: bytes, chunk_size: int) -> dict:
+    # Mirrors the old fetch_content + fetch_and_parse_url: concatenate every line, then re-split
+    buffer = ""
+    content = ""
+    async for chunk in chunked(payload, chunk_size):
+        buffer += chunk.decode()
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            content += line + "\n"
+    content += buffer
+    json_str = next(line for line in content.split('\n') if line.startswith('data:')).strip()[5:]
+    return json.loads(json_str)
+
+async def incremental(payload: bytes, chunk_size: int) -> dict:
+    async for event in iter_sse_events(chunked(payload, chunk_size), max_bytes=len(payload)):
+        data = json.loads(event.data)
+        if 'content' in data:
+            return data
+
+def timed(fn, *args, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        asyncio.run(fn(*args))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--chunk-kb", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    chunk_size = args.chunk_kb * 1024
+    print(f"{'size':>6} {'legacy (s)':>12} {'incremental (s)':>16} {'speedup':>8}")
+    for size_mb in args.sizes:
+        payload = build_stream(size_mb)
+        assert asyncio.run(legacy(payload, chunk_size)) == asyncio.run(incremental(payload, chunk_size))
+        old = timed(legacy, payload, chunk_size, repeat=args.repeat)
+        new = timed(incremental, payload, chunk_size, repeat=args.repeat)
+        print(f"{size_mb:>4}MB {old:>12.3f} {new:>16.3f} {old / new:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# URL canonicalization and a short-lived de-duplication index shared by read, extract and score.
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Parameters that only say where a click came from; anything else may change the content and is kept
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "twclid", "igshid",
+    "mc_cid", "mc_eid", "_ga", "_gl", "_hsenc", "_hsmi", "mkt_tok", "oly_anon_id", "oly_enc_id",
+    "ref_src", "cmpid", "ncid", "sr_share", "smid", "spm", "vero_id", "wt_mc", "ito"
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "mtm_", "hsa_")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def canonicalize_url(url: str) -> str:
+    """Collapse URLs that differ only in ways that can't change the page to one form.
+
+    The scheme and host are lowercased, the scheme's default port and known tracking parameters are
+    dropped, remaining query parameters are sorted and trailing slashes trimmed. In-page anchors are
+    dropped but client-side routes (#/... and #!...) are kept. Scheme and `www.` are left as they are.
+    A URL that can't be parsed (e.g. a non-numeric port) comes back stripped but otherwise unchanged.
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url.lstrip("/")
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or "").rstrip(".")
+    netloc = host
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path or "/")
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    ]
+    fragment = parts.fragment if parts.fragment.startswith(("/", "!")) else ""
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), fragment))
+
+def dedupe_by_url(items: Iterable[Any], url_of: Callable[[Any], str] = lambda item: item.url) -> List[Any]:
+    """Keep the first item for each canonical URL, preserving input order."""
+    seen = set()
+    unique = []
+    for item in items:
+        key = canonicalize_url(url_of(item))
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(item)
+    return unique
+
+def dedupe_urls(urls: Iterable[str]) -> List[str]:
+    return dedupe_by_url(urls, url_of=lambda url: url)
+
+class DedupIndex:
+    """Remembers recent results by canonical URL (plus an optional scope) so repeats skip the work.
+
+    With `max_bytes`, `size_of(result)` estimates each result's size and the least recently used
+    results are dropped once their total passes it, whatever max_entries allows.
+    """
+
+    def __init__(self, ttl: float = 900.0, max_entries: int = 5000, max_bytes: Optional[int] = None,
+                 size_of: Optional[Callable[[Any], int]] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of or (lambda result: 0)
+        self.counters = {"hits": 0, "misses": 0}
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _key(self, url: str, scope: tuple) -> tuple:
+        return (canonicalize_url(url),) + tuple(scope)
+
+    def _drop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def get(self, url: str, *scope) -> Optional[Any]:
+        key = self._key(url, scope)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] >= self.ttl:
+                self._drop(key)
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def put(self, url: str, result: Any, *scope):
+        key = self._key(url, scope)
+        size = self.size_of(result)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.time(), result, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), bytes=self._bytes)
+
+_indexes: Dict[str, DedupIndex] = {}
+
+def get_dedup_index(name: str, ttl: float = 900.0, max_entries: int = 5000, max_bytes: Optional[int] = None,
+                    size_of: Optional[Callable[[Any], int]] = None) -> DedupIndex:
+    if name not in _indexes:
+        _indexes[name] = DedupIndex(ttl=ttl, max_entries=max_entries, max_bytes=max_bytes, size_of=size_of)
+    return _indexes[name]
@@ -0,0 +1,120 @@
+# Check: deadlines, hedged requests and circuit breakers against fake_anthropic.py with injected faults.
+# Usage: python check_resilience.py
+# Each scenario starts its own fake server and handler; the script exits non-zero on the first failed check.
+import os
+import sys
+import time
+import asyncio
+import logging
+from types import SimpleNamespace
+
+# llm_handler imports its siblings as endpoints.*, so the api directory has to be importable too
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.update(ANTHROPIC_API_KEY="fake", LLM_CACHE_MODE="off", LLM_MAX_RETRIES="1", LLM_FALLBACK_MODELS="{}")
+
+from fake_anthropic import serve
+from endpoints.llm_handler import LLMCallError, LLMHandler
+from endpoints.rate_limiter import RateLimiter
+
+MODEL = "claude-3-haiku-20240307"
+REQUEST = SimpleNamespace(
+    models=[MODEL], query="ai", num_urls=3,
+    user_profile=SimpleNamespace(
+        preferred_name="a", country_of_residence="b", age=30, job_title="c", job_function="d", interests=[], goals=[]
+    )
+)
+
+def handler_for(server, rpm: float = 6000, **settings) -> LLMHandler:
+    """A handler pointed at `server`, with LLM_* settings given as keyword arguments (e.g. deadline=0.5)."""
+    os.environ.update({f"LLM_{name.upper()}": str(value) for name, value in settings.items()})
+    handler = LLMHandler(base_url=f"http://127.0.0.1:{server.server_port}")
+    handler.rate_limiter = RateLimiter(default_rpm=rpm, default_tpm=10 ** 8)
+    return handler
+
+async def outcomes(calls) -> list:
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    return ["ok" if not isinstance(result, Exception) else type(result).__name__ for result in results]
+
+def check(condition: bool, message: str):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    if not condition:
+        sys.exit(1)
+
+async def queue_wait_is_not_a_timeout():
+    # 20 calls against 10 requests/s: most wait in the local queue far longer than the deadline
+    server = serve(0, latency="fixed:0.05")
+    handler = handler_for(server, rpm=600, deadline=0.5, breaker_min_calls=4, hedge_percentile=0)
+    handler.rate_limiter.budget(MODEL).requests = 0
+    started = time.monotonic()
+    results = await outcomes([handler.acall_tool("generate_urls", REQUEST) for _ in range(20)])
+    check(results.count("ok") == 20, f"queued calls all succeed ({results.count('ok')}/20 in {time.monotonic() - started:.1f}s)")
+    check(handler.breakers[MODEL].state == "closed", "local queueing leaves the breaker closed")
+    server.shutdown()
+
+async def deadline_opens_and_recovers():
+    server = serve(0, latency="fixed:1.0")
+    handler = handler_for(server, deadline=0.3, breaker_min_calls=4, breaker_cooldown=0.5, hedge_percentile=0)
+    results = await outcomes([handler.acall_tool("generate_urls", REQUEST) for _ in range(4)])
+    check(results == ["LLMCallError"] * 4, "slow responses fail at the deadline")
+    check(handler.breakers[MODEL].state == "open", "timeouts open the breaker")
+    sent = server.state.message_requests
+    try:
+        await handler.acall_tool("generate_urls", REQUEST)
+        check(False, "an open breaker fails fast")
+    except LLMCallError:
+        check(server.state.message_requests == sent, "an open breaker fails fast without calling the API")
+    server.state.latency = lambda: 0.0
+    await asyncio.sleep(0.5)
+    await handler.acall_tool("generate_urls", REQUEST)
+    check(handler.breakers[MODEL].state == "closed", "a successful trial call after the cooldown closes the breaker")
+    server.shutdown()
+
+async def overloaded_opens_breaker():
+    server = serve(0, error_rate=1.0)
+    handler = handler_for(server, deadline=5, breaker_min_calls=4, hedge_percentile=0)
+    results = await outcomes([handler.acall_tool("generate_urls", REQUEST) for _ in range(2)])
+    check(results == ["LLMCallError"] * 2, "529s fail once retries run out")
+    check(handler.breakers[MODEL].state == "open", "529s open the breaker")
+    server.shutdown()
+
+async def rate_limited_waits_for_retry_after():
+    # With hedging on, a 429 must not be re-sent by the hedge; the retry waits out retry-after
+    server = serve(0, error_rate=1.0, error_status=429, retry_after=1.0)
+    handler = handler_for(server, deadline=5, hedge_percentile=0.95, hedge_min_delay=0.05, breaker_min_calls=100)
+    for _ in range(20):
+        handler.latency.record(f"generate_urls:{MODEL}", 0.01)
+    call = asyncio.ensure_future(handler.acall_tool("generate_urls", REQUEST))
+    await asyncio.sleep(0.5)
+    check(server.state.message_requests == 1, f"a 429 is not hedged or retried at once ({server.state.message_requests} requests)")
+    check(handler.rate_limiter.budget(MODEL).metrics()["paused_for"] > 0.3, "the 429 pauses the model's budget")
+    results = await outcomes([call])
+    gap = server.state.request_times[1] - server.state.request_times[0] if server.state.message_requests == 2 else 0.0
+    check(results == ["LLMCallError"] and server.state.message_requests == 2, "one retry after the first 429, then the error")
+    check(gap >= 1.0, f"the retry waits for retry-after ({gap:.2f}s)")
+    server.shutdown()
+
+async def hedging_beats_stalls(hedge_percentile: float) -> tuple:
+    server = serve(0, latency="fixed:0.05", stall_rate=0.3, stall_seconds=5, seed=1)
+    handler = handler_for(server, deadline=1.0, hedge_percentile=hedge_percentile, hedge_min_delay=0.2, breaker_min_calls=100)
+    for _ in range(20):
+        handler.latency.record(f"generate_urls:{MODEL}", 0.05)
+    results = []
+    for _ in range(10):
+        results += await outcomes([handler.acall_tool("generate_urls", REQUEST)])
+    sent = server.state.message_requests
+    server.shutdown()
+    return results.count("ok"), sent
+
+async def main():
+    await queue_wait_is_not_a_timeout()
+    await deadline_opens_and_recovers()
+    await overloaded_opens_breaker()
+    await rate_limited_waits_for_retry_after()
+    unhedged, _ = await hedging_beats_stalls(0)
+    hedged, sent = await hedging_beats_stalls(0.95)
+    check(hedged == 10 and unhedged < 10, f"hedging recovers stalled calls ({unhedged}/10 without, {hedged}/10 with, {sent} requests)")
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)  # The endpoints log every call at INFO; only the checks matter here
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+# Check: the embedding fast path's thresholds on hand-made similarity matrices and embeddings.
+# Usage: python check_topic_scorer.py
+# The script exits non-zero on the first failed check.
+import sys
+import logging
+from types import SimpleNamespace
+import numpy as np
+from topic_scorer import TopicScorer, calibrate
+
+HIGH, LOW = 0.75, 0.55
+TOPICS = [f"topic {index}" for index in range(24)]
+
+def check(condition: bool, message: str):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    if not condition:
+        sys.exit(1)
+
+def unrelated_article_scores_zero():
+    # Low similarity to every topic, with one topic still well above the article's own average
+    similarities = np.full((1, len(TOPICS)), 0.20)
+    similarities[0, 3] = 0.45
+    scores, borderline = calibrate(similarities, HIGH, LOW)
+    check(scores.sum() == 0, "an article unrelated to every topic scores all 0")
+    check(not borderline[0], "an unrelated article is clear-cut, not borderline")
+
+def clear_match_is_confident():
+    similarities = np.full((1, len(TOPICS)), 0.30)
+    similarities[0, 5] = 0.85
+    scores, borderline = calibrate(similarities, HIGH, LOW)
+    check(scores[0].tolist() == [int(index == 5) for index in range(len(TOPICS))], "a clear match scores 1 on its topic only")
+    check(not borderline[0], "a clear match skips the LLM")
+
+def in_between_is_borderline():
+    similarities = np.full((1, len(TOPICS)), 0.30)
+    similarities[0, 7] = 0.65
+    _, borderline = calibrate(similarities, HIGH, LOW)
+    check(bool(borderline[0]), "a topic between the thresholds sends the article to the LLM")
+
+def scorer_end_to_end():
+    # Orthonormal topic vectors; each article is a mix of them with a known cosine to each topic
+    topic_vectors = np.eye(len(TOPICS) + 1)[:len(TOPICS)]
+    noise = np.eye(len(TOPICS) + 1)[len(TOPICS)]
+    articles = {
+        "https://example.com/unrelated": 0.2 * topic_vectors[0] + noise,
+        "https://example.com/match": 0.9 * topic_vectors[2] + 0.2 * noise,
+        "https://example.com/unsure": 0.7 * topic_vectors[4] + 0.7 * noise
+    }
+
+    def embed(texts):
+        return [articles.get(text, topic_vectors[TOPICS.index(text)] if text in TOPICS else noise) for text in texts], "fake"
+
+    scorer = TopicScorer(embed, high=HIGH, low=LOW, max_chars=200)
+    # article_text() starts with the title, so the URL as title picks the article's vector
+    batch = [SimpleNamespace(url=url, title=url, keywords=[], description="", content="") for url in articles]
+    confident, uncertain = scorer.score(batch, TOPICS)
+    check(sum(confident.get("https://example.com/unrelated", {"x": 1}).values()) == 0, "the scorer gives an unrelated article all 0")
+    check(confident.get("https://example.com/match", {}).get(TOPICS[2]) == 1, "the scorer gives a clear match its topic")
+    check(uncertain == ["https://example.com/unsure"], "only the in-between article is left for the LLM")
+
+def main():
+    unrelated_article_scores_zero()
+    clear_match_is_confident()
+    in_between_is_borderline()
+    scorer_end_to_end()
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)  # The scorer logs each batch at INFO; only the checks matter here
+    main()
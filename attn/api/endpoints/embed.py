@@ -4,7 +4,7 @@ from typing import List, Union, Optional
 import logging
 from datetime import datetime
 from modal import Image, App, web_endpoint, Secret, Mount
-from embedding_handler import EmbeddingHandler
+from embedding_handler import get_embedding_handler
 import os
 import sys
 
@@ -53,17 +53,13 @@ async def embed(request: EmbedRequest):
     logger.info(f"Current sys.path: {sys.path}")
     logger.info(f"Files in the /app/endpoints directory: {os.listdir('/app/endpoints')}")
 
-    huggingface_token = os.getenv("HUGGINGFACE_TOKEN")
-    embedding_handler = EmbeddingHandler(huggingface_token=huggingface_token)
+    embedding_handler = get_embedding_handler()
 
     try:
         if isinstance(request.data, str):
             embeddings, model = embedding_handler.generate_embedding(request.data, request.model, request.task)
         else:
-            embeddings = []
-            for text in request.data:
-                embedding, model = embedding_handler.generate_embedding(text, request.model, request.task)
-                embeddings.append(embedding)
+            embeddings, model = embedding_handler.generate_embeddings(request.data, request.model, request.task)
         return {"embeddings": embeddings, "model": model}
     except Exception as e:
         logger.error(f"Embedding generation failed: {str(e)}")
@@ -1,4 +1,7 @@
+import os
 import logging
+import threading
+from typing import Optional
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 import torch
 
@@ -8,19 +11,55 @@ class EmbeddingHandler:
     def __init__(self, default_model="Alibaba-NLP/gte-large-en-v1.5", huggingface_token=None):
         self.default_model = default_model
         self.huggingface_token = huggingface_token
+        self.models = {}  # Loaded once per model name; loading takes far longer than embedding
+        self.lock = threading.Lock()
+
+    def _model(self, model):
+        with self.lock:
+            if model not in self.models:
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+                self.models[model] = HuggingFaceEmbedding(model_name=model, token=self.huggingface_token, device=device, trust_remote_code=True)
+                logger.info(f"Loaded embedding model: {model} on device: {device}")
+            return self.models[model]
 
     def generate_embedding(self, text, model=None, task=None):
         model = model or self.default_model
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        embed_model = HuggingFaceEmbedding(model_name=model, token=self.huggingface_token, device=device, trust_remote_code=True)
+        embed_model = self._model(model)
 
         if task:
             text = f"Instruct: {task}\nQuery: {text}"
 
         try:
             embedding = embed_model.get_text_embedding(text)
-            logger.info(f"Generated embedding for text: {text[:30]}... with model: {model} on device: {device}")  # Log the first 30 characters
+            logger.info(f"Generated embedding for text: {text[:30]}... with model: {model}")  # Log the first 30 characters
             return embedding, model
         except Exception as e:
             logger.error(f"Embedding generation failed: {str(e)}")
             raise Exception(f"Embedding generation failed: {str(e)}")
+
+    def generate_embeddings(self, texts, model=None, task=None, batch_size=32):
+        """Embed many texts in batches of batch_size; returns (embeddings in input order, model)."""
+        model = model or self.default_model
+        embed_model = self._model(model)
+
+        if task:
+            texts = [f"Instruct: {task}\nQuery: {text}" for text in texts]
+
+        try:
+            embeddings = []
+            for start in range(0, len(texts), batch_size):
+                embeddings.extend(embed_model.get_text_embedding_batch(texts[start:start + batch_size]))
+            logger.info(f"Generated {len(embeddings)} embeddings with model: {model}")
+            return embeddings, model
+        except Exception as e:
+            logger.error(f"Embedding generation failed: {str(e)}")
+            raise Exception(f"Embedding generation failed: {str(e)}")
+
+_embedding_handler: Optional[EmbeddingHandler] = None
+
+def get_embedding_handler() -> EmbeddingHandler:
+    """Process-wide handler, so loaded models are shared between requests."""
+    global _embedding_handler
+    if _embedding_handler is None:
+        _embedding_handler = EmbeddingHandler(huggingface_token=os.getenv("HUGGINGFACE_TOKEN"))
+    return _embedding_handler
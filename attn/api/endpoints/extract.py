@@ -1,13 +1,14 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional
 import json
+import asyncio
 from datetime import datetime
 import sys
 import os
 from modal import Image, App, web_endpoint, Secret, Mount
-import re
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -47,6 +48,14 @@ class ExtractRequest(BaseModel):
     user_profile: UserProfile  # Use the UserProfile model instead of dict
     num_urls: Optional[int] = 10  # Default number of URLs to extract
     query: str = Field(default="")  # Add this line to include the query attribute
+    rerank: bool = False  # Have the LLM pick the most relevant of the links found on each page
+    max_concurrency: int = 8  # Articles processed at the same time
+    stream: bool = False  # Stream NDJSON results as each article finishes instead of one response in input order
+    batch: bool = False  # Extract structure from several articles per LLM call
+    batch_size: int = 5  # Most articles in one batched call
+    batch_token_budget: int = 8000  # Estimated prompt tokens of article text per batched call
+    cascade: bool = False  # Start with the fastest model and escalate only when its output falls short
+    force_refresh: bool = False  # Re-extract every article instead of reusing results for unchanged ones
 
 @app.function(mounts=[
     Mount.from_local_dir(
@@ -63,6 +72,18 @@ async def extract(request: ExtractRequest):
     logger.info(f"Current sys.path: {sys.path}")
     logger.info(f"Files in the /app/endpoints directory: {os.listdir('/app/endpoints')}")
 
+    if not request.articles:
+        raise HTTPException(status_code=400, detail="No articles provided")
+
+    if request.stream:
+        # One NDJSON line per article, as soon as it is done
+        results = iter_article_urls(request) if request.query else iter_structures(request)
+
+        async def result_stream():
+            async for result in results:
+                yield json.dumps(result) + "\n"
+        return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
     if request.query:  # If a query is present, extract article URLs
         article_urls = await extract_article_urls(request)
         return {"article_urls": article_urls}
@@ -71,128 +92,275 @@ async def extract(request: ExtractRequest):
         return {"structured_data": structured_data}
 
 async def extract_article_urls(request: ExtractRequest, model_name: str = "claude-3-haiku-20240307"):
-    from llm_handler import LLMHandler
-    from prompts import get_prompts
-    llm_handler = LLMHandler()
+    from canonical import dedupe_urls
+    all_urls = []  # List to collect URLs from all articles
+    async for result in iter_article_urls(request, model_name, preserve_order=True):
+        all_urls.extend(result["article_urls"])
+    return dedupe_urls(all_urls)  # Return the collected URLs from all articles, one per canonical URL
+
+async def iter_article_urls(request: ExtractRequest, model_name: str = "claude-3-haiku-20240307", preserve_order: bool = False):
+    from llm_handler import get_llm_handler
+    from prompts import get_template, prompt_version
+    from canonical import dedupe_by_url, get_dedup_index
+    from fanout import fan_out
+    from links import extract_article_links
+    from tools import require_urls
+    from score_store import content_hash
+    llm_handler = get_llm_handler()
 
     if not request.articles:
         raise HTTPException(status_code=400, detail="No articles provided")
 
-    all_urls = []  # List to collect URLs from all articles
+    try:
+        get_template("rerank_article_urls")
+    except KeyError:
+        logger.error("Prompt configuration for 'rerank_article_urls' not found.")
+        raise HTTPException(status_code=500, detail="Configuration error")
+
+    recent = get_dedup_index("extract_article_urls")
+    # Results depend on who is asking and for what, so they are only reused for the same query, profile
+    # and models; the article's content hash is added per article below
+    scope = (
+        request.query, request.num_urls, request.user_profile.json(), request.rerank,
+        ",".join(llm_handler.cascade_models) if request.cascade else model_name, prompt_version("rerank_article_urls")
+    )
+
+    async def extract_one(article: ArticleData) -> List[str]:
+        article_scope = (content_hash(article),) + scope
+        cached = None if request.force_refresh else recent.get(article.url, *article_scope)
+        if cached is not None:
+            logger.info(f"Reusing recently extracted URLs for article with URL: {article.url}")
+            return cached
 
-    # Iterate over each article in the request
-    for article in request.articles:
         logger.info(f"Processing article {article.title} with URL: {article.url}")
-        try:
-            system_prompt, message_prompt = get_prompts(
-                "extract_article_urls", request,
-                url=article.url,
-                title=article.title,
-                keywords=",".join(article.keywords),
-                description=article.description,
-                content=article.content
-            )
-        except KeyError:
-            logger.error("Prompt configuration for 'extract_article_urls' not found.")
-            raise HTTPException(status_code=500, detail="Configuration error")
+        # Links found by read from the page's anchors; older clients send articles without them
+        candidates = article.article_urls or extract_article_links(article.url, markdown=article.content)
+        logger.info(f"Found {len(candidates)} candidate article URLs in {article.url}")
+        if not request.rerank or not candidates:
+            urls = candidates[:request.num_urls]
+            if urls:
+                recent.put(article.url, urls, *article_scope)
+            return urls
 
-        # Call the LLM and handle the response for each article
+        # Ask the LLM to rank the candidates; fall back to page order if that fails
         try:
-            logger.info(f"Extract - Preparing to call LLM for article with URL: {article.url}")
-            response_text = llm_handler.call_llm(
-                "extract_article_urls",
+            logger.info(f"Extract - Preparing to call LLM to rerank URLs for article with URL: {article.url}")
+            output = await llm_handler.acall_tool_cascade(
+                "rerank_article_urls",
                 request,
-                model_name=model_name,
+                models=None if request.cascade else [model_name],
+                validate=require_urls(min(request.num_urls, len(candidates))),
                 url=article.url,
                 title=article.title,
-                keywords=",".join(article.keywords),
                 description=article.description,
-                content=article.content
+                candidates="\n".join(candidates)
             )
-            urls = parse_urls_from_response(response_text)
-            all_urls.extend(urls)  # Add the extracted URLs to the main list
+            # Only keep URLs that were actually on the page
+            allowed = set(candidates)
+            urls = [item.url for item in output.urls if item.url in allowed][:request.num_urls]
         except Exception as e:
             logger.error(f"LLM call failed for article {article.url}: {str(e)}")
-            # Optionally continue to the next article or raise an HTTPException
-            continue  # Continue processing next articles even if one fails
-
-    return all_urls  # Return the collected URLs from all articles
-
-def parse_urls_from_response(text: str) -> List[str]:
-    try:
-        data = json.loads(text)
-        urls = [item["url"] for item in data["urls"]]
-        logger.info(f"URLs parsed from response: {urls}")
+            urls = []
+        urls = urls or candidates[:request.num_urls]
+        recent.put(article.url, urls, *article_scope)
         return urls
-    except (json.JSONDecodeError, KeyError) as e:
-        logger.error(f"Error parsing URLs from response: {str(e)}")
-        # Fallback to regex extraction if JSON parsing fails
-        return extract_urls_fallback(text)
 
-def extract_urls_fallback(text: str) -> List[str]:
-    # Regex to match URLs
-    url_pattern = re.compile(r'https?://[^\s"\'<>]+')
-    urls = url_pattern.findall(text)
+    async for _, article, result in fan_out(
+        dedupe_by_url(request.articles), extract_one,
+        max_concurrency=request.max_concurrency, preserve_order=preserve_order
+    ):
+        if isinstance(result, HTTPException):
+            raise result
+        if not isinstance(result, Exception):
+            yield {"url": article.url, "article_urls": result}
 
-    # Log the extracted URLs
-    logger.info(f"URLs parsed using fallback approach: {urls}")
+def result_keys(articles: List[ArticleData], models: str) -> Dict[str, str]:
+    """Score store keys by article URL; stored structure is reused only while none of its inputs changed."""
+    from score_store import content_hash, result_key
+    from prompts import prompt_version
+    version = prompt_version("extract_structure") + prompt_version("extract_structure_batch")
+    return {article.url: result_key(article.url, content_hash(article), "", models, version) for article in articles}
 
-    return urls
+def stored_structures(store, keys: Dict[str, str], articles: List[ArticleData], refresh: bool = False) -> Dict[str, dict]:
+    if store is None:
+        return {}
+    results = {}
+    for article in articles:
+        stored = store.get("extract_structure", keys[article.url], refresh=refresh)
+        if stored is not None:
+            results[article.url] = json.loads(stored)
+    return results
 
 async def extract_structure(request: ExtractRequest, model_name: str = "claude-3-haiku-20240307"):
-    from llm_handler import LLMHandler
-    from prompts import get_prompts
-    llm_handler = LLMHandler()
-
-    if not request.articles:
-        raise HTTPException(status_code=400, detail="No articles provided")
+    # Structured data comes back in input order; use iter_structures to get it as it finishes
+    return [result["structured_data"] async for result in iter_structures(request, model_name, preserve_order=True)]
 
-    structured_data = []  # List to collect structured data from all articles
+async def extract_structure_offline(request: ExtractRequest, model_name: str = "claude-3-haiku-20240307"):
+    """Extract structure from every article through the Message Batches API, for backfills that can wait."""
+    from llm_handler import get_llm_handler
+    from canonical import dedupe_by_url
+    from batches import run_tool_batch
+    from score_store import get_score_store
 
-    # Iterate over each article in the request
-    for article in request.articles:
-        logger.info(f"Processing article {article.title} with URL: {article.url}")
-        try:
-            system_prompt, message_prompt = get_prompts(
-                "extract_structure", request,
+    articles = dedupe_by_url(request.articles)
+    store = get_score_store()
+    keys = result_keys(articles, model_name)
+    previous = stored_structures(store, keys, articles, refresh=request.force_refresh)
+    outputs = await run_tool_batch(
+        get_llm_handler(), "extract_structure", request,
+        {
+            article.url: dict(
                 url=article.url,
                 title=article.title,
                 keywords=",".join(article.keywords),
                 description=article.description,
                 content=article.content
             )
-        except KeyError:
-            logger.error("Prompt configuration for 'extract_structure' not found.")
-            raise HTTPException(status_code=500, detail="Configuration error")
+            for article in articles if article.url not in previous
+        },
+        model_name=model_name
+    )
+    extracted = dict(previous)
+    for url, output in outputs.items():
+        if output is not None:
+            extracted[url] = output.dict()
+            if store is not None:
+                store.put("extract_structure", keys[url], url, json.dumps(extracted[url]))
+    return [{"url": article.url, "structured_data": extracted[article.url]} for article in articles if article.url in extracted]
+
+async def iter_structures(request: ExtractRequest, model_name: str = "claude-3-haiku-20240307", preserve_order: bool = False):
+    from llm_handler import get_llm_handler
+    from prompts import get_template
+    from canonical import canonicalize_url, dedupe_by_url, get_dedup_index
+    from fanout import fan_out
+    from batching import pack_batches, render_articles, require_results, results_by_url
+    from rate_limiter import estimate_tokens
+    from tools import require_fields
+    from score_store import get_score_store
+    llm_handler = get_llm_handler()
+    complete = require_fields("main_idea", "summary")  # Structure with these empty escalates or is retried alone
+
+    if not request.articles:
+        raise HTTPException(status_code=400, detail="No articles provided")
+
+    try:
+        get_template("extract_structure")
+    except KeyError:
+        logger.error("Prompt configuration for 'extract_structure' not found.")
+        raise HTTPException(status_code=500, detail="Configuration error")
+
+    recent = get_dedup_index("extract_structure")
+
+    # Articles extracted before with the same content, models and prompts keep their stored structure
+    articles = dedupe_by_url(request.articles)
+    store = get_score_store()
+    keys = result_keys(articles, ",".join(llm_handler.cascade_models) if request.cascade else model_name)
+    previous = stored_structures(store, keys, articles, refresh=request.force_refresh)
+    if previous:
+        logger.info(f"Reusing stored structure for {len(previous)} of {len(articles)} unchanged articles")
+
+    # Recent results are scoped by the same key as stored ones, so another configuration never gets them
+    def known(article: ArticleData):
+        if article.url in previous:
+            return previous[article.url]
+        return None if request.force_refresh else recent.get(article.url, keys[article.url])
 
+    def remember(article: ArticleData, data: dict):
+        recent.put(article.url, data, keys[article.url])
+        if store is not None:
+            store.put("extract_structure", keys[article.url], article.url, json.dumps(data))
+
+    async def extract_one(article: ArticleData) -> dict:
+        cached = known(article)
+        if cached is not None:
+            logger.info(f"Reusing known structure for article with URL: {article.url}")
+            return cached
+
+        logger.info(f"Processing article {article.title} with URL: {article.url}")
         # Call the LLM and handle the response for each article
         try:
             logger.info(f"Extract - Preparing to call LLM for article with URL: {article.url}")
-            response_text = llm_handler.call_llm(
+            output = await llm_handler.acall_tool_cascade(
                 "extract_structure",
                 request,
-                model_name=model_name,
+                models=None if request.cascade else [model_name],
+                refresh=request.force_refresh,
+                validate=complete,
                 url=article.url,
                 title=article.title,
                 keywords=",".join(article.keywords),
                 description=article.description,
                 content=article.content
             )
-            data = parse_structure_from_response(response_text)
-            structured_data.append(data)  # Add the extracted structured data to the main list
+            data = output.dict()
+            if data:
+                remember(article, data)
+            return data
         except Exception as e:
             logger.error(f"LLM call failed for article {article.url}: {str(e)}")
-            # Optionally continue to the next article or raise an HTTPException
-            continue  # Continue processing next articles even if one fails
+            return None  # Other articles carry on even if this one fails
 
-    return structured_data  # Return the collected structured data from all articles
+    async def extract_batch(batch: List[ArticleData]) -> List[dict]:
+        # Articles with stored or recent structure don't need a place in the batch
+        results = {article.url: known(article) for article in batch}
+        todo = [article for article in batch if results[article.url] is None]
+        if len(todo) > 1:
+            logger.info(f"Extracting structure from {len(todo)} articles in one call, starting with URL: {todo[0].url}")
+            try:
+                # Batches climb the same model ladder as single articles, so stored keys name the right models
+                output = await llm_handler.acall_tool_cascade(
+                    "extract_structure_batch",
+                    request,
+                    models=None if request.cascade else [model_name],
+                    refresh=request.force_refresh,
+                    validator=require_results(todo, complete),
+                    max_tokens=min(4096, 800 * len(todo)),
+                    articles=render_articles(todo)
+                )
+            except Exception as e:
+                # A batch that still misses articles after repair is used for the ones it covers
+                output = getattr(e, "output", None)
+                logger.error(f"Batched LLM call failed for {len(todo)} articles: {str(e)}")
+            extracted = results_by_url(output.results) if output is not None else {}
+            for article in todo:
+                item = extracted.get(canonicalize_url(article.url))
+                if item is not None and complete(item) is None:
+                    results[article.url] = item.dict(exclude={"url"})
+                    remember(article, results[article.url])
+        # Articles the batch missed or left incomplete go through the single-article prompt
+        missing = [article for article in batch if results[article.url] is None]
+        if missing:
+            logger.info(f"Extracting structure from {len(missing)} articles individually after the batched call")
+            for article, result in zip(missing, await asyncio.gather(*(extract_one(article) for article in missing))):
+                results[article.url] = result
+        return [results[article.url] for article in batch]
 
-def parse_structure_from_response(text: str) -> dict:
-    try:
-        data = json.loads(text)
-        logger.info(f"Structured data parsed from response: {data}")
-        return data
-    except (json.JSONDecodeError, KeyError) as e:
-        logger.error(f"Error parsing structured data from response: {str(e)}")
-        # Handle parsing error or return an empty dict
-        return {}
+    if request.batch:
+        batches = pack_batches(
+            articles,
+            lambda article: estimate_tokens(article.title, article.description, article.content),
+            budget=request.batch_token_budget,
+            max_items=request.batch_size
+        )
+        async for _, batch, results in fan_out(
+            batches, extract_batch, max_concurrency=request.max_concurrency, preserve_order=preserve_order
+        ):
+            if isinstance(results, HTTPException):
+                raise results
+            if isinstance(results, Exception):
+                logger.error(f"Structure extraction failed for a batch of {len(batch)} articles: {str(results)}")
+                continue
+            for article, result in zip(batch, results):
+                if result is not None:
+                    yield {"url": article.url, "structured_data": result}
+        return
+
+    # Articles are processed concurrently; the shared LLM handler still caps calls per process
+    async for _, article, result in fan_out(
+        articles, extract_one,
+        max_concurrency=request.max_concurrency, preserve_order=preserve_order
+    ):
+        if isinstance(result, HTTPException):
+            raise result
+        if result is not None and not isinstance(result, Exception):
+            yield {"url": article.url, "structured_data": result}
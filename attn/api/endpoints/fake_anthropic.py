@@ -0,0 +1,307 @@
+# Local stand-in for the Anthropic Messages and Message Batches APIs, for offline runs and load tests.
+# Usage: python fake_anthropic.py [--port 8765] [--batch-delay 2] [--latency lognormal:-1,0.8] [--error-rate 0.05]
+# then point the handler at it with ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=fake
+#
+# Tool calls are answered with placeholder input generated from the tool's schema. Article URLs are
+# copied from the prompt's "URL: ..." lines so results map back to the articles that were sent.
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import logging
+import threading
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+URL_LINE = re.compile(r"^\s*URL:\s*(\S+)", re.MULTILINE | re.IGNORECASE)
+TOPIC_LINE = re.compile(r"^\s*- (.+?)\s*$", re.MULTILINE)
+
+# Prompt prefixes seen so far, to report cache writes on first use and cache reads afterwards
+_cached_prefixes = set()
+_cache_lock = threading.Lock()
+
+def cache_usage(params: dict) -> dict:
+    system = params.get("system")
+    if not isinstance(system, list) or not any("cache_control" in block for block in system):
+        return {"cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+    last = max(index for index, block in enumerate(system) if "cache_control" in block)
+    prefix = json.dumps(params.get("tools", [])) + "".join(block["text"] for block in system[:last + 1])
+    tokens = len(prefix) // 4 + 1
+    with _cache_lock:
+        hit = prefix in _cached_prefixes
+        _cached_prefixes.add(prefix)
+    return {"cache_creation_input_tokens": 0 if hit else tokens, "cache_read_input_tokens": tokens if hit else 0}
+
+def fake_value(schema: dict, urls: list, key: str = "", topics: list = ()):
+    kind = schema.get("type")
+    if kind == "object" and "additionalProperties" in schema:
+        # Score maps: one entry per "- topic" line of the prompt
+        return {topic: fake_value(schema["additionalProperties"], urls, topic) for topic in topics}
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {name: fake_value(prop, urls, name, topics) for name, prop in properties.items()}
+    if kind == "array":
+        if key == "results":
+            # Batched tools: one result per article in the prompt
+            return [fake_value(schema["items"], [url], "", topics) for url in urls]
+        return [fake_value(schema["items"], urls, key, topics)]
+    if kind == "integer":
+        return 0
+    if kind == "number":
+        return 0.0
+    if kind == "boolean":
+        return False
+    if key == "url" and urls:
+        return urls[0]
+    return f"fake {key}".strip()
+
+def prompt_text(params: dict) -> str:
+    parts = []
+    for message in params.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content if isinstance(block, dict))
+    return "\n".join(parts)
+
+def fake_message(params: dict) -> dict:
+    text = prompt_text(params)
+    system = params.get("system") or ""
+    system_text = system if isinstance(system, str) else "".join(block.get("text", "") for block in system)
+    urls = URL_LINE.findall(text)
+    tools = {tool["name"]: tool for tool in params.get("tools", [])}
+    choice = params.get("tool_choice") or {}
+    if choice.get("type") == "tool" and choice.get("name") in tools:
+        tool = tools[choice["name"]]
+        content = [{
+            "type": "tool_use",
+            "id": f"toolu_{uuid.uuid4().hex[:24]}",
+            "name": tool["name"],
+            "input": fake_value(tool["input_schema"], urls, topics=TOPIC_LINE.findall(system_text + "\n" + text))
+        }]
+        stop_reason = "tool_use"
+    else:
+        content = [{"type": "text", "text": json.dumps({"urls": [{"url": url} for url in urls]})}]
+        stop_reason = "end_turn"
+    output = json.dumps(content)
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "fake"),
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": dict(cache_usage(params), input_tokens=len(text) // 4 + 1, output_tokens=len(output) // 4 + 1)
+    }
+
+def latency_sampler(spec: str, rng: random.Random = random):
+    """Parse "fixed:s", "uniform:lo,hi" or "lognormal:mu,sigma" into a function returning a delay in seconds."""
+    kind, _, args = (spec or "fixed:0").partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(*values)
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(*values)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def sse_events(message: dict, chunk_chars: int = 16):
+    """The Messages streaming events for a text message, with its text split into deltas."""
+    start = dict(message, content=[], stop_reason=None, usage=dict(message["usage"], output_tokens=1))
+    yield "message_start", {"type": "message_start", "message": start}
+    for index, block in enumerate(message["content"]):
+        text = block.get("text", "")
+        yield "content_block_start", {"type": "content_block_start", "index": index, "content_block": {"type": "text", "text": ""}}
+        for offset in range(0, len(text), chunk_chars):
+            delta = {"type": "text_delta", "text": text[offset:offset + chunk_chars]}
+            yield "content_block_delta", {"type": "content_block_delta", "index": index, "delta": delta}
+        yield "content_block_stop", {"type": "content_block_stop", "index": index}
+    yield "message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]}
+    }
+    yield "message_stop", {"type": "message_stop"}
+
+class FakeState:
+    def __init__(self, batch_delay: float = 2.0, latency: str = "fixed:0", error_rate: float = 0.0,
+                 stall_rate: float = 0.0, stall_seconds: float = 60.0, seed: Optional[int] = None,
+                 error_status: int = 529, retry_after: Optional[float] = None):
+        self.batch_delay = batch_delay
+        # Injected faults for /v1/messages: a delay before answering, errors (529 overloaded, or 429 rate
+        # limited, optionally with a retry-after header), and the occasional request (or stream) that
+        # hangs for stall_seconds.
+        # With a seed, requests arriving in the same order get the same faults.
+        self.random = random.Random(seed)
+        self.latency = latency_sampler(latency, self.random)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.message_requests = 0
+        self.request_times = []  # time.monotonic() of each /v1/messages request
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def create_batch(self, requests: list, base_url: str) -> dict:
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        with self.lock:
+            self.batches[batch_id] = {
+                "created": time.time(),
+                "requests": requests,
+                "results_url": f"{base_url}/v1/messages/batches/{batch_id}/results"
+            }
+        return self.batch_object(batch_id)
+
+    def batch_object(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        ended = time.time() - batch["created"] >= self.batch_delay
+        count = len(batch["requests"])
+        created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(batch["created"]))
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count if ended else 0,
+                "errored": 0, "canceled": 0, "expired": 0
+            },
+            "created_at": created_at,
+            "expires_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(batch["created"] + 86400)),
+            "ended_at": created_at if ended else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": batch["results_url"] if ended else None
+        }
+
+    def results(self, batch_id: str) -> str:
+        lines = [
+            json.dumps({"custom_id": entry["custom_id"], "result": {"type": "succeeded", "message": fake_message(entry["params"])}})
+            for entry in self.batches[batch_id]["requests"]
+        ]
+        return "\n".join(lines) + "\n"
+
+def make_handler(state: FakeState):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body, content_type: str = "application/json", headers: Optional[dict] = None):
+            payload = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The client timed out or a hedged duplicate won
+
+        def _not_found(self):
+            self._send(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+        def do_POST(self):
+            params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            path = urlsplit(self.path).path
+            if path == "/v1/messages":
+                self._message(params)
+            elif path == "/v1/messages/batches":
+                base_url = f"http://{self.headers.get('Host')}"
+                self._send(200, state.create_batch(params.get("requests", []), base_url))
+            else:
+                self._not_found()
+
+        def _message(self, params: dict):
+            with state.lock:
+                state.message_requests += 1
+                state.request_times.append(time.monotonic())
+                delay = state.latency()
+                error = state.random.random() < state.error_rate
+                stall = state.random.random() < state.stall_rate
+            time.sleep(delay)
+            if error:
+                headers = {"retry-after": str(state.retry_after)} if state.retry_after is not None else None
+                if state.error_status == 429:
+                    body = {"type": "error", "error": {"type": "rate_limit_error", "message": "Rate limited"}}
+                else:
+                    body = {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}
+                return self._send(state.error_status, body, headers=headers)
+            message = fake_message(params)
+            if not params.get("stream"):
+                if stall:
+                    time.sleep(state.stall_seconds)
+                return self._send(200, message)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            try:
+                for index, (event, data) in enumerate(sse_events(message)):
+                    if stall and index == 2:
+                        # Headers and message_start sent, then nothing: a stalled stream
+                        time.sleep(state.stall_seconds)
+                    self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The client gave up on this stream
+            self.close_connection = True
+
+        def do_GET(self):
+            parts = urlsplit(self.path).path.strip("/").split("/")
+            if parts[:3] != ["v1", "messages", "batches"] or len(parts) < 4 or parts[3] not in state.batches:
+                return self._not_found()
+            if len(parts) == 5 and parts[4] == "results":
+                return self._send(200, state.results(parts[3]), content_type="application/binary")
+            self._send(200, state.batch_object(parts[3]))
+
+        def log_message(self, format, *args):
+            logger.info(format % args)
+
+    Handler.state = state
+    return Handler
+
+def serve(port: int = 8765, batch_delay: float = 2.0, host: str = "127.0.0.1", **faults) -> ThreadingHTTPServer:
+    """Start the fake server on a background thread and return it; call .shutdown() to stop.
+
+    `faults` are passed to FakeState: latency, error_rate, error_status, retry_after, stall_rate,
+    stall_seconds, seed. The FakeState is available as server.state, e.g. to change faults or count
+    requests mid-run.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(FakeState(batch_delay, **faults)))
+    server.state = server.RequestHandlerClass.state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Fake Anthropic API listening on http://{host}:{server.server_port}")
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="Seconds before a batch reports it has ended")
+    parser.add_argument("--latency", default="fixed:0", help="Response delay: fixed:s, uniform:lo,hi or lognormal:mu,sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of messages answered with an error")
+    parser.add_argument("--error-status", type=int, default=529, choices=[429, 529], help="Status of injected errors")
+    parser.add_argument("--retry-after", type=float, help="retry-after seconds sent with injected errors")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of messages that hang before finishing")
+    parser.add_argument("--stall-seconds", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, help="Seed for injected faults, for reproducible runs")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    state = FakeState(
+        args.batch_delay, args.latency, args.error_rate, args.stall_rate, args.stall_seconds, args.seed,
+        error_status=args.error_status, retry_after=args.retry_after
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(state))
+    logger.info(f"Fake Anthropic API listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+async def fan_out(
+    items: Iterable[Any],
+    worker: Callable[[Any], Awaitable[Any]],
+    max_concurrency: int = 10,
+    per_key_limit: Optional[int] = None,
+    key: Optional[Callable[[Any], Any]] = None,
+    preserve_order: bool = False,
+) -> AsyncIterator[Tuple[int, Any, Any]]:
+    """Run `worker` over `items` concurrently and yield (index, item, result) as each one finishes.
+
+    At most `max_concurrency` workers run at once, and at most `per_key_limit` share the same
+    `key(item)` (e.g. the URL host). Exceptions raised by a worker are yielded as its result so
+    one failure never stops the batch. With `preserve_order`, results are held back and yielded
+    in input order.
+    """
+    items = list(items)
+    global_semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    key_semaphores: Dict[Any, asyncio.Semaphore] = {}
+    done: asyncio.Queue = asyncio.Queue()
+
+    async def run(index: int, item: Any):
+        key_semaphore = None
+        if key is not None and per_key_limit:
+            key_semaphore = key_semaphores.setdefault(key(item), asyncio.Semaphore(per_key_limit))
+        try:
+            # Take the per-key slot first so items waiting on a busy host don't hold global slots
+            if key_semaphore is None:
+                async with global_semaphore:
+                    result = await worker(item)
+            else:
+                async with key_semaphore, global_semaphore:
+                    result = await worker(item)
+        except Exception as e:
+            logger.error(f"Worker failed for item {index}: {str(e)}")
+            result = e
+        await done.put((index, item, result))
+
+    tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+    try:
+        held = {}
+        next_index = 0
+        for _ in range(len(tasks)):
+            index, item, result = await done.get()
+            if not preserve_order:
+                yield index, item, result
+                continue
+            held[index] = (item, result)
+            while next_index in held:
+                item, result = held.pop(next_index)
+                yield next_index, item, result
+                next_index += 1
+    finally:
+        # The consumer may stop early (e.g. client disconnect); don't leave fetches running
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,90 @@
+# Head-only HTML metadata extraction: tokenizes <head> tags and stops reading at </head>.
+import codecs
+import logging
+from html.parser import HTMLParser
+from typing import AsyncIterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Tags that can only appear once the document body has started
+BODY_TAGS = {"body", "main", "article", "section", "div", "p", "h1", "h2", "header", "nav"}
+
+class HeadParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+        self.title_parts = []
+        self.in_title = False
+        self.meta = {}
+        self.canonical_url = None
+        self.language = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag in BODY_TAGS:
+            self.done = True
+            return
+        attrs = {key.lower(): value for key, value in attrs if value is not None}
+        if tag == "html":
+            self.language = attrs.get("lang") or self.language
+        elif tag == "title":
+            self.in_title = True
+        elif tag == "meta":
+            key = (attrs.get("name") or attrs.get("property") or attrs.get("http-equiv") or "").lower()
+            if key and "content" in attrs:
+                # First occurrence wins, matching soup.find()
+                self.meta.setdefault(key, attrs["content"])
+        elif tag == "link" and "canonical" in attrs.get("rel", "").lower().split():
+            self.canonical_url = self.canonical_url or attrs.get("href")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self.in_title = False
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_title and not self.done:
+            self.title_parts.append(data)
+
+    def metadata(self) -> dict:
+        title = "".join(self.title_parts).strip() or 'No title found'
+        description = (self.meta.get("description") or "").strip()
+        if not description:
+            description = (self.meta.get("og:description") or "").strip() or 'No description found'
+        keywords = self.meta.get("keywords")
+        return {
+            'title': title,
+            'description': description,
+            'keywords': keywords.split(',') if keywords else [],
+            'canonical_url': self.canonical_url,
+            'og_title': self.meta.get("og:title"),
+            'published_time': self.meta.get("article:published_time"),
+            'language': self.language or self.meta.get("content-language") or self.meta.get("og:locale")
+        }
+
+def extract_head_metadata(html: str) -> dict:
+    parser = HeadParser()
+    end = html.lower().find("</head>")
+    parser.feed(html if end < 0 else html[:end + len("</head>")])
+    return parser.metadata()
+
+async def stream_head_metadata(chunks: AsyncIterator[bytes], encoding: Optional[str] = None,
+                               max_bytes: int = 512 * 1024) -> Tuple[dict, int]:
+    """Feed response chunks to the head parser until </head> (or `max_bytes`); returns metadata and bytes read."""
+    parser = HeadParser()
+    try:
+        decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done or received >= max_bytes:
+            break
+    return parser.metadata(), received
@@ -0,0 +1,36 @@
+# Local HTML-to-text extraction engines used when an article is read with a single origin fetch.
+import logging
+import re
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+LOCAL_ENGINES = ["bs4", "trafilatura"]
+
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "nav", "header", "footer", "aside", "form"]
+
+def extract_text(html: str, engine: str = "bs4", url: str = None) -> str:
+    if engine == "bs4":
+        return _extract_text_bs4(html)
+    if engine == "trafilatura":
+        return _extract_text_trafilatura(html, url)
+    raise ValueError(f"Unknown extraction engine: {engine}")
+
+def _extract_text_bs4(html: str) -> str:
+    soup = BeautifulSoup(html, 'lxml')
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+    root = soup.find('article') or soup.find('main') or soup.body or soup
+    text = root.get_text("\n")
+    # Collapse the whitespace-only lines left behind by layout markup
+    lines = (re.sub(r'[ \t\xa0]+', ' ', line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+def _extract_text_trafilatura(html: str, url: str = None) -> str:
+    try:
+        import trafilatura
+    except ImportError:
+        logger.error("The trafilatura engine was requested but trafilatura is not installed")
+        raise ValueError("Extraction engine 'trafilatura' is not available")
+    text = trafilatura.extract(html, url=url, include_comments=False, include_tables=False)
+    return text or ""
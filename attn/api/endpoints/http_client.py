@@ -0,0 +1,76 @@
+# Process-wide pooled HTTP clients for the reader service and origin sites.
+import os
+import logging
+from typing import Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+READER_BASE_URL = "https://r.jina.ai"
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36",
+    "Referer": "https://www.google.com/"
+}
+
+_reader_client: Optional[httpx.AsyncClient] = None
+_origin_client: Optional[httpx.AsyncClient] = None
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_env_int("HTTP_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=_env_int("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20),
+        keepalive_expiry=_env_float("HTTP_KEEPALIVE_EXPIRY", 30.0)
+    )
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("h2 is not installed; reader client falls back to HTTP/1.1 keep-alive")
+        return False
+
+def get_reader_client() -> httpx.AsyncClient:
+    """Shared client for r.jina.ai, multiplexing requests over HTTP/2 when available."""
+    global _reader_client
+    if _reader_client is None or _reader_client.is_closed:
+        _reader_client = httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=_limits(),
+            timeout=httpx.Timeout(_env_float("READER_TIMEOUT", 180.0), connect=_env_float("HTTP_CONNECT_TIMEOUT", 10.0))
+        )
+        logger.info("Created pooled reader HTTP client")
+    return _reader_client
+
+def get_origin_client() -> httpx.AsyncClient:
+    """Shared client for direct requests to article origins."""
+    global _origin_client
+    if _origin_client is None or _origin_client.is_closed:
+        _origin_client = httpx.AsyncClient(
+            follow_redirects=True,
+            headers=DEFAULT_HEADERS,
+            limits=_limits(),
+            timeout=httpx.Timeout(_env_float("ORIGIN_TIMEOUT", 30.0), connect=_env_float("HTTP_CONNECT_TIMEOUT", 10.0))
+        )
+        logger.info("Created pooled origin HTTP client")
+    return _origin_client
+
+async def startup():
+    get_reader_client()
+    get_origin_client()
+
+async def shutdown():
+    global _reader_client, _origin_client
+    for client in (_reader_client, _origin_client):
+        if client is not None and not client.is_closed:
+            await client.aclose()
+    _reader_client = None
+    _origin_client = None
+    logger.info("Closed pooled HTTP clients")
@@ -0,0 +1,220 @@
+# Resumable bulk read jobs: per-URL state lives in SQLite so a job survives restarts and dropped clients.
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class JobStore:
+    def __init__(self, path: str, max_attempts: int = 3, retry_backoff: float = 30.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff  # Seconds before the first retry of a URL, doubling after each attempt
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                engine TEXT NOT NULL,
+                workers INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS job_urls (
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                article TEXT,
+                updated_at REAL,
+                PRIMARY KEY (job_id, position)
+            );
+            CREATE INDEX IF NOT EXISTS job_urls_state ON job_urls (job_id, state);
+        """)
+        self._db.commit()
+
+    def create_job(self, urls: List[str], engine: str = "dual", workers: int = 10) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, engine, workers, total, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, engine, workers, len(urls), now)
+            )
+            self._db.executemany(
+                "INSERT INTO job_urls (job_id, position, url, updated_at) VALUES (?, ?, ?, ?)",
+                [(job_id, position, url, now) for position, url in enumerate(urls)]
+            )
+            self._db.commit()
+        logger.info(f"Created read job {job_id} with {len(urls)} URLs")
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, engine, workers, total, created_at, finished_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(["id", "engine", "workers", "total", "created_at", "finished_at"], row))
+
+    # When a pending URL may be claimed again: right away on its first attempt, after its backoff on retries
+    READY_AT = "updated_at + CASE WHEN attempts = 0 THEN 0 ELSE ? * (1 << (attempts - 1)) END"
+
+    def claim(self, job_id: str) -> Optional[tuple]:
+        """Mark the next pending URL as in progress and return (position, url), or None when none is ready."""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT position, url FROM job_urls WHERE job_id = ? AND state = 'pending' AND {self.READY_AT} <= ? "
+                "ORDER BY attempts, position LIMIT 1",
+                (job_id, self.retry_backoff, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE job_urls SET state = 'in_progress', attempts = attempts + 1, updated_at = ? "
+                "WHERE job_id = ? AND position = ?",
+                (time.time(), job_id, row[0])
+            )
+            self._db.commit()
+        return row
+
+    def next_retry_in(self, job_id: str) -> Optional[float]:
+        """Seconds until the next pending URL is ready, or None when the job has none left."""
+        with self._lock:
+            ready_at = self._db.execute(
+                f"SELECT MIN({self.READY_AT}) FROM job_urls WHERE job_id = ? AND state = 'pending'",
+                (self.retry_backoff, job_id)
+            ).fetchone()[0]
+        return None if ready_at is None else max(0.0, ready_at - time.time())
+
+    def complete(self, job_id: str, position: int, article: str):
+        self._update(job_id, position, "read", article=article)
+
+    def fail(self, job_id: str, position: int, error: str, article: Optional[str] = None):
+        """Record a failed attempt; the URL goes back to pending until it runs out of attempts."""
+        with self._lock:
+            attempts = self._db.execute(
+                "SELECT attempts FROM job_urls WHERE job_id = ? AND position = ?", (job_id, position)
+            ).fetchone()[0]
+        state = "error" if attempts >= self.max_attempts else "pending"
+        self._update(job_id, position, state, article=article, last_error=error)
+
+    def _update(self, job_id: str, position: int, state: str, article: Optional[str] = None, last_error: Optional[str] = None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE job_urls SET state = ?, article = ?, last_error = ?, updated_at = ? WHERE job_id = ? AND position = ?",
+                (state, article, last_error, time.time(), job_id, position)
+            )
+            self._db.commit()
+
+    def release_in_progress(self, job_id: str):
+        """URLs left in progress by a process that died go back to pending."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE job_urls SET state = 'pending' WHERE job_id = ? AND state = 'in_progress'", (job_id,)
+            )
+            self._db.commit()
+
+    def finish(self, job_id: str):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET finished_at = ? WHERE id = ?", (time.time(), job_id))
+            self._db.commit()
+
+    def unfinished_jobs(self) -> List[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM jobs WHERE finished_at IS NULL ORDER BY created_at").fetchall()
+        return [row[0] for row in rows]
+
+    def progress(self, job_id: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT state, COUNT(*) FROM job_urls WHERE job_id = ? GROUP BY state", (job_id,)
+            ).fetchall()
+        counts = {"pending": 0, "in_progress": 0, "read": 0, "error": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 100, state: str = "read") -> List[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT position, url, state, attempts, last_error, article FROM job_urls "
+                "WHERE job_id = ? AND state = ? ORDER BY position LIMIT ? OFFSET ?",
+                (job_id, state, limit, offset)
+            ).fetchall()
+        return [dict(zip(["position", "url", "state", "attempts", "last_error", "article"], row)) for row in rows]
+
+async def run_job(store: JobStore, job_id: str, fetch: Callable[[str, str], Awaitable], workers: int = 10):
+    """Drive a job to completion; `fetch(url, engine)` returns an ArticleData-like object with a status."""
+    job = store.get_job(job_id)
+    store.release_in_progress(job_id)
+    logger.info(f"Running read job {job_id} with {workers} workers")
+
+    async def worker():
+        while True:
+            claimed = store.claim(job_id)
+            if claimed is None:
+                # Failed URLs wait out their backoff; the worker stops once nothing is pending
+                delay = store.next_retry_in(job_id)
+                if delay is None:
+                    return
+                await asyncio.sleep(delay)
+                continue
+            position, url = claimed
+            try:
+                article = await fetch(url, job["engine"])
+                if article.status == 'read':
+                    store.complete(job_id, position, article.json())
+                else:
+                    store.fail(job_id, position, "Article could not be read", article=article.json())
+            except Exception as e:
+                logger.error(f"Read job {job_id} failed on {url}: {str(e)}")
+                store.fail(job_id, position, str(e))
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    store.finish(job_id)
+    logger.info(f"Read job {job_id} finished: {store.progress(job_id)}")
+
+_job_store: Optional[JobStore] = None
+_running: Dict[str, asyncio.Task] = {}
+
+def get_job_store() -> JobStore:
+    global _job_store
+    if _job_store is None:
+        _job_store = JobStore(
+            path=os.getenv("JOB_STORE_PATH", "/tmp/attn_read_jobs.sqlite3"),
+            max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", 3)),
+            retry_backoff=float(os.getenv("JOB_RETRY_BACKOFF", 30))
+        )
+    return _job_store
+
+def start_job(job_id: str, fetch: Callable[[str, str], Awaitable], workers: int = 10) -> asyncio.Task:
+    """Run a job in the background of this process unless it is already running here."""
+    task = _running.get(job_id)
+    if task is None or task.done():
+        task = asyncio.create_task(run_job(get_job_store(), job_id, fetch, workers))
+        _running[job_id] = task
+        # Finished jobs drop out so _running only holds the jobs in flight
+        task.add_done_callback(lambda done: _running.pop(job_id, None) if _running.get(job_id) is done else None)
+    return task
+
+def resume_jobs(fetch: Callable[[str, str], Awaitable]) -> List[str]:
+    """Restart every unfinished job; URLs already read are not fetched again."""
+    store = get_job_store()
+    resumed = []
+    for job_id in store.unfinished_jobs():
+        job = store.get_job(job_id)
+        start_job(job_id, fetch, workers=job["workers"])
+        resumed.append(job_id)
+    if resumed:
+        logger.info(f"Resumed read jobs: {resumed}")
+    return resumed
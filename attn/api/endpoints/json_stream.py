@@ -0,0 +1,70 @@
+# Pull complete JSON objects out of a model's response while it is still being generated.
+import json
+import bisect
+import logging
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class IncrementalObjectParser:
+    """Feed text deltas; get back each nested JSON object (below the top level) as soon as its closing brace arrives.
+
+    Only braces outside of strings count, and every character is scanned once however the text is split.
+    Deltas are kept as a list of chunks, so feeding stays linear in the response length.
+    """
+
+    def __init__(self, required_key: Optional[str] = None):
+        self.required_key = required_key
+        self.chunks: List[str] = []
+        self.chunk_offsets: List[int] = []  # offset of each chunk's first character in the whole text
+        self.length = 0
+        self.starts: List[int] = []  # offsets of currently open '{'
+        self.in_string = False
+        self.escaped = False
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return "".join(self.chunks)
+
+    def feed(self, delta: str) -> Iterator[dict]:
+        offset = self.length
+        self.chunks.append(delta)
+        self.chunk_offsets.append(offset)
+        self.length += len(delta)
+        for i, char in enumerate(delta, offset):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.starts.append(i)
+            elif char == "}" and self.starts:
+                start = self.starts.pop()
+                if self.starts:  # skip the outermost object; that's the whole response
+                    obj = self._load(self._slice(start, i + 1))
+                    if obj is not None:
+                        yield obj
+
+    def _slice(self, start: int, end: int) -> str:
+        """text[start:end], joining only the chunks it spans."""
+        first = bisect.bisect_right(self.chunk_offsets, start) - 1
+        last = bisect.bisect_left(self.chunk_offsets, end)
+        joined = "".join(self.chunks[first:last])
+        base = self.chunk_offsets[first]
+        return joined[start - base:end - base]
+
+    def _load(self, fragment: str) -> Optional[dict]:
+        try:
+            obj = json.loads(fragment)
+        except json.JSONDecodeError:
+            logger.debug(f"Skipping malformed JSON fragment: {fragment[:200]}")
+            return None
+        if self.required_key and (not isinstance(obj, dict) or self.required_key not in obj):
+            return None
+        return obj
@@ -0,0 +1,147 @@
+# Deterministic article-link discovery from fetched HTML (or reader markdown) without an LLM call.
+import re
+import logging
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from canonical import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+SOCIAL_HOSTS = {
+    "facebook.com", "twitter.com", "x.com", "linkedin.com", "instagram.com", "youtube.com", "youtu.be",
+    "tiktok.com", "pinterest.com", "reddit.com", "t.me", "telegram.me", "whatsapp.com", "wa.me",
+    "threads.net", "mastodon.social", "news.google.com", "flipboard.com", "apple.news"
+}
+# Page furniture whose links are navigation rather than articles
+SKIP_TAGS = {"nav", "footer", "header", "aside", "menu", "form"}
+SKIP_HINTS = ("nav", "menu", "footer", "social", "share", "breadcrumb", "subscribe", "newsletter",
+              "cookie", "signin", "login", "related-tags", "pagination", "sidebar")
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+NON_ARTICLE_PATH = re.compile(
+    r"/(tag|tags|topic|topics|category|categories|section|author|authors|profile|search|login|signin|"
+    r"signup|register|subscribe|subscription|newsletter|newsletters|account|about|about-us|contact|"
+    r"contact-us|privacy|privacy-policy|terms|terms-of-service|cookies|careers|jobs|advertise|feed|rss|"
+    r"page|events|podcasts?|videos?|gallery|galleries|shop|store)(/|$)",
+    re.IGNORECASE
+)
+NON_ARTICLE_EXTENSIONS = re.compile(r"\.(jpe?g|png|gif|webp|svg|pdf|zip|mp3|mp4|css|js|xml|json)$", re.IGNORECASE)
+DATE_IN_PATH = re.compile(r"/(19|20)\d{2}/(0?[1-9]|1[0-2])(/|-)")
+NUMERIC_ID = re.compile(r"\d{5,}")
+SLUG = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+){3,}", re.IGNORECASE)
+MARKDOWN_LINK = re.compile(r"(?<!!)\[([^\]]*)\]\((\S+?)(?:\s+\"[^\"]*\")?\)")
+# Reader output wraps teaser images in links: [![alt](image)](href)
+MARKDOWN_IMAGE_LINK = re.compile(r"\[!\[([^\]]*)\]\([^)]*\)\]\((\S+?)(?:\s+\"[^\"]*\")?\)")
+
+def site_of(host: str) -> str:
+    """Approximate registrable domain: the last two labels, or three under a two-letter second level (co.uk)."""
+    labels = host.lower().rstrip(".").split(".")
+    if labels and labels[0] == "www":
+        labels = labels[1:]
+    if len(labels) >= 3 and len(labels[-1]) == 2 and len(labels[-2]) <= 3:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+class AnchorCollector(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.anchors: List[Tuple[str, str]] = []
+        self._stack: List[Tuple[str, bool]] = []  # (tag, starts a skipped region)
+        self._skip_depth = 0
+        self._href: Optional[str] = None
+        self._text: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "a":
+            self._finish_anchor()
+            if not self._skip_depth and attrs.get("href"):
+                self._href = attrs["href"]
+                self._text = []
+            return
+        if tag in VOID_TAGS:
+            return
+        marker = " ".join(filter(None, [attrs.get("class"), attrs.get("id"), attrs.get("role")])).lower()
+        skip = tag in SKIP_TAGS or any(hint in marker for hint in SKIP_HINTS)
+        self._stack.append((tag, skip))
+        if skip:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self._finish_anchor()
+            return
+        # Pop back to the matching open tag, tolerating unclosed children
+        if not any(open_tag == tag for open_tag, _ in self._stack):
+            return
+        while self._stack:
+            open_tag, skip = self._stack.pop()
+            if skip:
+                self._skip_depth -= 1
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+
+    def _finish_anchor(self):
+        if self._href is not None:
+            self.anchors.append((self._href, " ".join("".join(self._text).split())))
+        self._href = None
+        self._text = []
+
+    def close(self):
+        super().close()
+        self._finish_anchor()
+
+def anchors_from_html(html: str) -> List[Tuple[str, str]]:
+    collector = AnchorCollector()
+    collector.feed(html)
+    collector.close()
+    return collector.anchors
+
+def anchors_from_markdown(text: str) -> List[Tuple[str, str]]:
+    matches = list(MARKDOWN_LINK.finditer(text)) + list(MARKDOWN_IMAGE_LINK.finditer(text))
+    matches.sort(key=lambda match: match.start())
+    return [(match.group(2), match.group(1).strip()) for match in matches]
+
+def is_article_link(url: str, base_url: str, text: str = "") -> bool:
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    host = parts.hostname.lower()
+    if site_of(host) in SOCIAL_HOSTS or host in SOCIAL_HOSTS:
+        return False
+    if site_of(host) != site_of(urlsplit(base_url).hostname or ""):
+        return False
+    path = parts.path.rstrip("/")
+    if not path or NON_ARTICLE_PATH.search(path) or NON_ARTICLE_EXTENSIONS.search(path):
+        return False
+    last_segment = path.rsplit("/", 1)[-1]
+    if DATE_IN_PATH.search(path) or NUMERIC_ID.search(last_segment) or SLUG.search(last_segment):
+        return True
+    # Short slugs still look like articles when the anchor reads like a headline
+    return path.count("/") >= 2 and len(text.split()) >= 5
+
+def extract_article_links(base_url: str, html: Optional[str] = None, markdown: Optional[str] = None,
+                          limit: Optional[int] = 100) -> List[str]:
+    """Article URLs linked from a page, resolved against `base_url`, in page order and de-duplicated."""
+    anchors = anchors_from_html(html) if html is not None else anchors_from_markdown(markdown or "")
+    page = canonicalize_url(base_url)
+    seen = set()
+    links = []
+    for href, text in anchors:
+        if href.startswith(("#", "mailto:", "tel:", "javascript:")):
+            continue
+        parts = urlsplit(urljoin(base_url, href.strip()))
+        url = urlunsplit((parts.scheme, parts.netloc, parts.path, parts.query, ""))
+        key = canonicalize_url(url)
+        if key == page or key in seen or not is_article_link(url, base_url, text):
+            continue
+        seen.add(key)
+        links.append(url)
+        if limit and len(links) >= limit:
+            break
+    return links
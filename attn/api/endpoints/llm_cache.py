@@ -0,0 +1,141 @@
+# Cache of LLM responses keyed on the fully rendered request: an in-memory LRU in front of SQLite.
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# off: no caching. on: read and write. record: always call the model and overwrite.
+# replay: answer only from the cache and fail on a miss, so a pipeline can run offline.
+CACHE_MODES = {"off", "on", "record", "replay"}
+
+def response_key(model: str, system: Optional[str], message: str, max_tokens: int,
+                 tools: Optional[list] = None, version: str = "") -> str:
+    payload = json.dumps(
+        {"model": model, "system": system, "message": message, "max_tokens": max_tokens, "tools": tools, "version": version},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    def __init__(self, path: str, mode: str = "on", ttl: float = 86400.0, max_entries: int = 50000, memory_entries: int = 1000):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (response, stored_at)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                function_name TEXT,
+                response TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._db.commit()
+        logger.info(f"LLM cache opened at {path} (mode={mode}, ttl={ttl}s, max_entries={max_entries})")
+
+    @property
+    def reads(self) -> bool:
+        return self.mode in ("on", "replay")
+
+    @property
+    def writes(self) -> bool:
+        return self.mode in ("on", "record")
+
+    def _expired(self, stored_at: float) -> bool:
+        # Replay serves whatever was recorded, however old
+        return self.mode != "replay" and time.time() - stored_at >= self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.reads:
+            return None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[1]):
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[0]
+            row = self._db.execute("SELECT response, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1]):
+                self.counters["misses"] += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self._remember(key, row[0], row[1])
+            self.counters["disk_hits"] += 1
+        return row[0]
+
+    def put(self, key: str, model: str, response: str, function_name: Optional[str] = None):
+        if not self.writes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, function_name, response, stored_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, function_name, response, now, now)
+            )
+            self._remember(key, response, now)
+            self.counters["stores"] += 1
+            self._evict()
+            self._db.commit()
+
+    def _remember(self, key: str, response: str, stored_at: float):
+        self._memory[key] = (response, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            stats = dict(self.counters, entries=entries, memory_entries=len(self._memory), mode=self.mode)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+    def _evict(self):
+        count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,)
+            )
+            self.counters["evictions"] += excess
+
+_llm_cache: Optional[LLMCache] = None
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Process-wide cache configured from the environment; None when LLM_CACHE_MODE=off."""
+    global _llm_cache
+    mode = os.getenv("LLM_CACHE_MODE", "on")
+    if mode == "off":
+        return None
+    if _llm_cache is None:
+        _llm_cache = LLMCache(
+            path=os.getenv("LLM_CACHE_PATH", "/tmp/attn_llm_cache.sqlite3"),
+            mode=mode,
+            ttl=float(os.getenv("LLM_CACHE_TTL", 86400)),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 50000)),
+            memory_entries=int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", 1000))
+        )
+    return _llm_cache
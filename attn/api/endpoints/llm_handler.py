@@ -1,43 +1,454 @@
 import sys
 sys.path.append('/Users/erniesg/code/erniesg/shareshare/attn/api/')
-from endpoints.prompts import get_prompts
+from endpoints.prompts import get_prompt_parts, prompt_version
+from endpoints.llm_cache import get_llm_cache, response_key
+from endpoints.rate_limiter import estimate_tokens, get_rate_limiter
+from endpoints.tools import function_tools, get_tool, tool_models
+from endpoints.resilience import CircuitBreaker, DeadlineExceeded, LatencyTracker, hedged, with_deadline
 import anthropic
+import json
+import time
+import asyncio
 import os
 import logging
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
-class LLMHandler:
-    def __init__(self, api_key=None):
-        self.client = anthropic.Anthropic(api_key=api_key or os.getenv("ANTHROPIC_API_KEY"))
+# Rate limited and overloaded; both are worth waiting out rather than failing the article
+RETRY_STATUSES = {429, 529}
+
+class LLMCallError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class ToolOutputError(LLMCallError):
+    """The model's tool input still didn't validate after the repair turn.
+
+    `output` is the parsed output when only the caller's validator rejected it, else None.
+    """
+
+    def __init__(self, message, output=None):
+        super().__init__(message)
+        self.output = output
+
+def retry_after_of(error, attempt):
+    """Seconds to wait before retrying: the server's retry-after if it sent one, else exponential backoff."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return min(60.0, 2.0 ** attempt)
+
+def upstream_failure(error):
+    """Whether an error says the model's API is unhealthy (5xx, 429, timeouts), not that the request was bad."""
+    if isinstance(error, (DeadlineExceeded, anthropic.APIConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return isinstance(error, anthropic.APIStatusError) and status_code is not None and (status_code == 429 or status_code >= 500)
+
+class TierStats:
+    """Outcomes and latency of one model in a cascade."""
+
+    def __init__(self):
+        self.counts = {"calls": 0, "accepted": 0, "rejected": 0, "errors": 0}
+        self.latencies = deque(maxlen=500)
+
+    def record(self, outcome, latency):
+        self.counts["calls"] += 1
+        self.counts[outcome] += 1
+        self.latencies.append(latency)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return dict(
+            self.counts,
+            hit_rate=self.counts["accepted"] / self.counts["calls"] if self.counts["calls"] else 0.0,
+            latency_p50=latencies[len(latencies) // 2] if latencies else 0.0,
+            latency_p95=latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+        )
 
-    def call_llm(self, function_name, request, model_name=None, **kwargs):
-        logger.info(f"LLM Handler - Received kwargs in call_llm: {kwargs}")  # Log the contents of kwargs
+def system_text(system):
+    if isinstance(system, list):
+        return "\n".join(block["text"] for block in system)
+    return system
 
-        system_prompt, message_prompt = get_prompts(function_name, request, **kwargs)
-        # Log the prompts being sent to the LLM
-        logger.info(f"System Prompt: {system_prompt}")
-        logger.info(f"Message Prompt: {message_prompt}")
+class LLMHandler:
+    def __init__(self, api_key=None, max_in_flight=None, base_url=None):
+        api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
+        # Point base_url (or ANTHROPIC_BASE_URL) at fake_anthropic.py to run without network access
+        base_url = base_url or os.getenv("ANTHROPIC_BASE_URL")
+        # Hard cap per HTTP request; tool calls also have LLM_DEADLINE once sent, streams LLM_STALL_TIMEOUT
+        timeout = float(os.getenv("LLM_TIMEOUT", 120))
+        # Retries are ours, so they go through the rate limiter instead of around it
+        self.async_client = anthropic.AsyncAnthropic(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        # Caps concurrent LLM calls from this process; extra callers wait their turn
+        self.max_in_flight = max_in_flight or int(os.getenv("LLM_MAX_IN_FLIGHT", 8))
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.rate_limiter = get_rate_limiter()
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", 4))
+        self.max_tokens = 1000
+        self.cache = get_llm_cache()
+        # Mark each prompt's static prefix for provider-side prompt caching
+        self.prompt_caching = os.getenv("PROMPT_CACHING", "1") != "0"
+        self.usage = {}  # function name -> token counters, including prompt cache reads and writes
+        # Cheapest first; a cascade only moves on when a model's output fails validation
+        self.cascade_models = os.getenv("LLM_CASCADE_MODELS", "claude-3-haiku-20240307,claude-3-opus-20240229").split(",")
+        self.tier_stats = {}  # (function name, model) -> TierStats
+        # Tail latency: a deadline per request once it is sent, a gap allowed between streamed chunks, and a
+        # duplicate request once a call has taken longer than LLM_HEDGE_PERCENTILE of recent calls (0 disables)
+        self.deadline = float(os.getenv("LLM_DEADLINE", 90))
+        self.stall_timeout = float(os.getenv("LLM_STALL_TIMEOUT", 20))
+        self.hedge_percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", 0.95))
+        self.hedge_min_delay = float(os.getenv("LLM_HEDGE_MIN_DELAY", 1.0))
+        self.latency = LatencyTracker()
+        # While a model's breaker is open its calls fail fast, or go to its fallback if one is set here,
+        # e.g. '{"claude-3-haiku-20240307": "claude-3-5-haiku-20241022"}'
+        self.fallback_models = json.loads(os.getenv("LLM_FALLBACK_MODELS", "{}"))
+        self.breakers = {}  # model -> CircuitBreaker
+
+    def _prepare(self, function_name, request, model_name=None, **kwargs):
+        # Prompt bodies are logged by the template, and only with LOG_PROMPTS=1
+        system_prompt, prefix_prompt, message_prompt = get_prompt_parts(function_name, request, **kwargs)
         model_to_use = model_name if model_name else request.models[0]
+        return model_to_use, self._system(system_prompt, prefix_prompt), message_prompt
 
-        try:
-            # Always use the streaming API
-            with self.client.messages.stream(
-                model=model_to_use,
-                max_tokens=1000,
-                messages=[{"role": "user", "content": message_prompt}],
-                system=system_prompt if system_prompt else None  # Pass system prompt if available
-            ) as stream:
+    def _system(self, system_prompt, prefix_prompt):
+        """The system prompt, as content blocks ending in the cacheable prefix when the prompt has one."""
+        if not prefix_prompt:
+            return system_prompt
+        blocks = [{"type": "text", "text": system_prompt}] if system_prompt else []
+        prefix_block = {"type": "text", "text": prefix_prompt}
+        if self.prompt_caching:
+            prefix_block["cache_control"] = {"type": "ephemeral"}
+        return blocks + [prefix_block]
+
+    def _record_usage(self, function_name, usage):
+        totals = self.usage.setdefault(function_name, {
+            "calls": 0, "input_tokens": 0, "output_tokens": 0, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0
+        })
+        totals["calls"] += 1
+        for field in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+            totals[field] += getattr(usage, field, None) or 0
+
+    async def acall_llm(self, function_name, request, model_name=None, **kwargs):
+        """The whole response text, without blocking the event loop while the model responds."""
+        content = []
+        async for text in self.astream_llm(function_name, request, model_name, **kwargs):
+            content.append(text)
+        return ''.join(content)
+
+    async def astream_llm(self, function_name, request, model_name=None, **kwargs):
+        """Yield response text as the model generates it.
+
+        Each attempt first reserves the prompt's estimated input tokens plus max_tokens against the
+        model's RPM/TPM budget; the unused part is handed back once the response reports its usage.
+        A 429/529 is retried only while nothing has been yielded yet.
+        """
+        model_to_use, system_prompt, message_prompt = self._prepare(function_name, request, model_name, **kwargs)
+        # Routed first, so responses are cached under the model that actually produced them
+        model_to_use = self._route(model_to_use)
+        breaker = self._breaker(model_to_use)
+        cache_key, cached = self._cache_lookup(function_name, model_to_use, system_prompt, message_prompt)
+        if cached is not None:
+            breaker.abandon()
+            yield cached
+            return
+
+        reserved = estimate_tokens(system_text(system_prompt), message_prompt) + self.max_tokens
+
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(model_to_use, reserved)
+            async with self.semaphore:
+                used = reserved
                 content = []
-                for text in stream.text_stream:
-                    content.append(text)
-                    logger.info(f"Streaming text: {text}")
-            full_content = ''.join(content)
-            logger.info(
-                f"LLM API request completed with completed response: {full_content}"
-                f"\nResponse type: {type(full_content)}"
+                try:
+                    async with self.async_client.messages.stream(
+                        model=model_to_use,
+                        max_tokens=self.max_tokens,
+                        messages=[{"role": "user", "content": message_prompt}],
+                        system=system_prompt if system_prompt else None  # Pass system prompt if available
+                    ) as stream:
+                        chunks = stream.text_stream.__aiter__()
+                        while True:
+                            # A stalled stream is abandoned (and retried if nothing was sent yet)
+                            try:
+                                text = await with_deadline(chunks.__anext__(), self.stall_timeout)
+                            except StopAsyncIteration:
+                                break
+                            content.append(text)
+                            yield text
+                        usage = (await stream.get_final_message()).usage
+                        used = usage.input_tokens + usage.output_tokens
+                        self._record_usage(function_name, usage)
+                    full_content = ''.join(content)
+                    logger.info(f"LLM API request completed with {len(full_content)} characters from {model_to_use}")
+                    if cache_key is not None and full_content:
+                        self.cache.put(cache_key, model_to_use, full_content, function_name)
+                    breaker.record(error=False)
+                    return
+                except Exception as e:
+                    breaker.record(error=upstream_failure(e))
+                    self._retry_or_raise(e, model_to_use, attempt, retryable=not content)
+                except BaseException:
+                    breaker.abandon()
+                    raise
+                finally:
+                    self.rate_limiter.settle(model_to_use, reserved, used)
+
+    async def acall_tool(self, function_name, request, model_name=None, max_tokens=None, refresh=False, validator=None, **kwargs):
+        """Force the model to answer through the function's tool and return the validated output model.
+
+        Tool input that doesn't validate gets one repair turn listing the errors before ToolOutputError.
+        `validator(output)` can reject a parsed output by raising ValueError; its errors go into the
+        same repair turn, and outputs it rejects are never cached.
+        With refresh the response cache is not read, only overwritten with the new output.
+        """
+        tool_name = function_tools[function_name]
+        tool, output_model = get_tool(tool_name), tool_models[tool_name]
+        max_tokens = max_tokens or self.max_tokens
+        model_to_use, system_prompt, message_prompt = self._prepare(function_name, request, model_name, **kwargs)
+        # Routed first, so outputs are cached under the model that actually produced them
+        model_to_use = self._route(model_to_use)
+        cache_key, cached = self._cache_lookup(
+            function_name, model_to_use, system_prompt, message_prompt, tools=[tool], max_tokens=max_tokens, refresh=refresh
+        )
+        if cached is not None:
+            self._breaker(model_to_use).abandon()
+            return output_model.parse_raw(cached)
+
+        messages = [{"role": "user", "content": message_prompt}]
+        for repair in range(2):
+            response = await self._create(
+                function_name,
+                model_to_use,
+                estimate_tokens(system_text(system_prompt), *(json.dumps(message["content"]) for message in messages)) + max_tokens,
+                max_tokens=max_tokens,
+                system=system_prompt if system_prompt else None,
+                messages=messages,
+                tools=[tool],
+                tool_choice={"type": "tool", "name": tool_name}
             )
-            return full_content
-        except Exception as e:
-            logger.error(f"LLM API call failed: {str(e)}")
-            raise Exception(f"LLM API call failed: {str(e)}")
+            tool_use = next((block for block in response.content if block.type == "tool_use"), None)
+            if tool_use is None:
+                raise ToolOutputError(f"LLM API call failed: {model_to_use} did not call {tool_name}")
+            output = None
+            try:
+                output = output_model.parse_obj(tool_use.input)
+                if validator is not None:
+                    validator(output)
+            except ValueError as e:
+                if repair:
+                    logger.error(f"{tool_name} output still invalid after repair: {str(e)}")
+                    raise ToolOutputError(f"LLM API call failed: invalid {tool_name} output: {str(e)}", output=output)
+                logger.warning(f"{tool_name} output invalid, asking {model_to_use} to repair it: {str(e)}")
+                messages = messages + [
+                    {"role": "assistant", "content": [
+                        {"type": "tool_use", "id": tool_use.id, "name": tool_use.name, "input": tool_use.input}
+                    ]},
+                    {"role": "user", "content": [{
+                        "type": "tool_result",
+                        "tool_use_id": tool_use.id,
+                        "is_error": True,
+                        "content": f"The input did not match the {tool_name} schema: {str(e)}\nCall {tool_name} again with corrected input."
+                    }]}
+                ]
+                continue
+            if cache_key is not None:
+                self.cache.put(cache_key, model_to_use, output.json(), function_name)
+            return output
+
+    async def acall_tool_cascade(self, function_name, request, models=None, validate=None, refresh=False, **kwargs):
+        """acall_tool on each model in turn until one's output passes `validate`.
+
+        `validate(output)` returns why the output is unusable, or None to accept it. Call errors also
+        escalate, as do outputs acall_tool's `validator` still rejects after repair. When every model
+        fails validation the last output is returned as a best effort.
+        """
+        models = models or self.cascade_models
+        last_output, last_error = None, None
+        for tier, model in enumerate(models):
+            stats = self.tier_stats.setdefault((function_name, model), TierStats())
+            started = time.monotonic()
+            try:
+                output = await self.acall_tool(function_name, request, model_name=model, refresh=refresh, **kwargs)
+                problem = validate(output) if validate else None
+            except LLMCallError as e:
+                output = getattr(e, "output", None)
+                if output is None:
+                    stats.record("errors", time.monotonic() - started)
+                    logger.warning(f"Cascade {function_name}: {model} failed: {str(e)}")
+                    last_error = e
+                    continue
+                problem = str(e)  # Parsed, but the caller's validator rejected it even after repair
+            if problem is None:
+                stats.record("accepted", time.monotonic() - started)
+                return output
+            stats.record("rejected", time.monotonic() - started)
+            logger.info(f"Cascade {function_name}: {model} output rejected ({problem})")
+            last_output = output
+        if last_output is not None:
+            return last_output
+        raise last_error
+
+    def tool_request(self, function_name, request, model_name=None, max_tokens=None, **kwargs):
+        """messages.create parameters that force the function's tool, e.g. for one request of a Message Batch."""
+        tool_name = function_tools[function_name]
+        model_to_use, system_prompt, message_prompt = self._prepare(function_name, request, model_name, **kwargs)
+        params = {
+            "model": model_to_use,
+            "max_tokens": max_tokens or self.max_tokens,
+            "messages": [{"role": "user", "content": message_prompt}],
+            "tools": [get_tool(tool_name)],
+            "tool_choice": {"type": "tool", "name": tool_name}
+        }
+        if system_prompt:
+            params["system"] = system_prompt
+        return params
+
+    def parse_tool_output(self, function_name, message):
+        """Validate the forced tool call in a response message against the tool's output model."""
+        tool_name = function_tools[function_name]
+        tool_use = next((block for block in message.content if block.type == "tool_use"), None)
+        if tool_use is None:
+            raise ToolOutputError(f"LLM API call failed: {message.model} did not call {tool_name}")
+        try:
+            return tool_models[tool_name].parse_obj(tool_use.input)
+        except ValueError as e:
+            raise ToolOutputError(f"LLM API call failed: invalid {tool_name} output: {str(e)}")
+
+    async def _create(self, function_name, model, reserved, max_tokens=None, **params):
+        """messages.create on an already routed model, behind the rate limiter, retried on 429/529 and hedged once it runs longer than usual.
+
+        The deadline and the hedge timer only start once the call holds its rate budget and an in-flight
+        slot, so time spent queueing locally never times a call out or counts against the model's breaker.
+        """
+        breaker = self._breaker(model)
+        key = f"{function_name}:{model}"
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(model, reserved)
+            async with self.semaphore:
+                async def send():
+                    # Every request settles its own reservation: the first one's was taken above, a hedge's by may_hedge
+                    used = reserved
+                    try:
+                        response = await self.async_client.messages.create(model=model, max_tokens=max_tokens or self.max_tokens, **params)
+                        used = response.usage.input_tokens + response.usage.output_tokens
+                        self._record_usage(function_name, response.usage)
+                        return response
+                    finally:
+                        self.rate_limiter.settle(model, reserved, used)
+
+                started = time.monotonic()
+                try:
+                    response = await with_deadline(
+                        # A hedge only goes out if there is rate budget to spare right now, and doesn't wait for an in-flight slot
+                        hedged(send, self._hedge_after(key, model), may_hedge=lambda: self.rate_limiter.try_acquire(model, reserved)),
+                        self.deadline
+                    )
+                except DeadlineExceeded as e:
+                    breaker.record(error=True)
+                    logger.error(f"LLM API call failed: {str(e)}")
+                    raise LLMCallError(f"LLM API call failed: {str(e)}")
+                except Exception as e:
+                    breaker.record(error=upstream_failure(e))
+                    self._retry_or_raise(e, model, attempt)
+                    continue
+                except BaseException:
+                    breaker.abandon()
+                    raise
+                breaker.record(error=False)
+                self.latency.record(key, time.monotonic() - started)
+                logger.info(f"LLM API request completed with {response.usage.output_tokens} output tokens from {model}")
+                return response
+
+    def _hedge_after(self, key, model):
+        """Seconds before a duplicate request is sent, or None to not hedge."""
+        # Hedging only helps when there is spare budget; a queued duplicate just waits behind the original
+        if not self.hedge_percentile or self.rate_limiter.budget(model).waiting:
+            return None
+        percentile = self.latency.percentile(key, self.hedge_percentile)
+        return max(self.hedge_min_delay, percentile) if percentile is not None else None
+
+    def _breaker(self, model):
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(
+                error_threshold=float(os.getenv("LLM_BREAKER_ERROR_RATE", 0.5)),
+                min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", 10)),
+                cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+            )
+        return self.breakers[model]
+
+    def _route(self, model):
+        """The model to call: `model` unless its breaker is open, then its fallback if that one's breaker is closed."""
+        if self._breaker(model).allow():
+            return model
+        fallback = self.fallback_models.get(model)
+        if fallback and self._breaker(fallback).state == "closed":
+            logger.warning(f"Circuit open for {model}, using {fallback}")
+            return fallback
+        raise LLMCallError(f"LLM API call failed: circuit open for {model}")
+
+    def _cache_lookup(self, function_name, model, system_prompt, message_prompt, tools=None, max_tokens=None, refresh=False):
+        """Return (cache key, cached response); the key is None when caching is off.
+
+        refresh skips the read so the response is recomputed and stored again.
+        """
+        if self.cache is None:
+            return None, None
+        cache_key = response_key(
+            model, system_prompt, message_prompt, max_tokens or self.max_tokens, tools=tools,
+            version=f"{prompt_version(function_name)}:{os.getenv('LLM_CACHE_VERSION', '1')}"
+        )
+        cached = None if refresh else self.cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"LLM cache hit for {function_name} on {model}")
+        elif self.cache.mode == "replay":
+            raise LLMCallError(f"LLM API call failed: no recorded response for {function_name} in replay mode")
+        return cache_key, cached
+
+    def _retry_or_raise(self, error, model, attempt, retryable=True):
+        """Pause the model and return when the error is worth retrying; otherwise raise LLMCallError."""
+        status_code = getattr(error, "status_code", None)
+        if isinstance(error, DeadlineExceeded) and retryable and attempt < self.max_retries:
+            logger.warning(f"LLM API stream stalled, retrying (attempt {attempt + 1})")
+            return
+        if isinstance(error, anthropic.APIStatusError) and status_code in RETRY_STATUSES \
+                and retryable and attempt < self.max_retries:
+            delay = retry_after_of(error, attempt)
+            logger.warning(f"LLM API returned {status_code}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            self.rate_limiter.pause(model, delay)
+            return
+        logger.error(f"LLM API call failed: {str(error)}")
+        raise LLMCallError(f"LLM API call failed: {str(error)}", status_code=status_code)
+
+    def metrics(self):
+        """Per-model rate-limit queue depth and wait times, response cache hit rates and per-function token usage."""
+        usage = {}
+        for function_name, totals in self.usage.items():
+            prompt_tokens = totals["input_tokens"] + totals["cache_read_input_tokens"] + totals["cache_creation_input_tokens"]
+            usage[function_name] = dict(
+                totals, prompt_cache_hit_rate=totals["cache_read_input_tokens"] / prompt_tokens if prompt_tokens else 0.0
+            )
+        return {
+            "in_flight_limit": self.max_in_flight,
+            "models": self.rate_limiter.metrics(),
+            "cache": self.cache.stats() if self.cache else None,
+            "usage": usage,
+            "breakers": {model: breaker.stats() for model, breaker in self.breakers.items()},
+            "cascade": {
+                function_name: {model: stats.summary() for (name, model), stats in self.tier_stats.items() if name == function_name}
+                for function_name in {name for name, _ in self.tier_stats}
+            }
+        }
+
+_llm_handler = None
+
+def get_llm_handler():
+    """Process-wide handler so every request shares one pooled client and one in-flight limit."""
+    global _llm_handler
+    if _llm_handler is None:
+        _llm_handler = LLMHandler()
+    return _llm_handler
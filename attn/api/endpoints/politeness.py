@@ -0,0 +1,218 @@
+# Per-domain politeness for origin and reader fetches: token buckets, robots.txt and adaptive backoff.
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 503}
+
+class RobotsDisallowed(Exception):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, rate: Optional[float] = None):
+        """Take one token, waiting at `rate` tokens per second (defaults to the bucket's own rate)."""
+        rate = rate or self.rate
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / rate)
+
+class DomainState:
+    def __init__(self, rate: float, burst: float):
+        self.base_rate = rate
+        self.bucket = TokenBucket(rate, burst)
+        self.rate_factor = 1.0  # Shrinks on 429/503, recovers on success
+        self.crawl_delay: Optional[float] = None
+        self.robots: Optional[RobotFileParser] = None
+        self.robots_fetched_at = 0.0
+        self.robots_lock = asyncio.Lock()
+        self.penalty_until = 0.0
+        self.consecutive_failures = 0
+
+    @property
+    def rate(self) -> float:
+        rate = self.base_rate * self.rate_factor
+        if self.crawl_delay:
+            rate = min(rate, 1.0 / self.crawl_delay)
+        return rate
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def interleave_by_domain(urls: List[str]) -> List[str]:
+    """Round-robin URLs across hosts so a publisher-heavy batch doesn't queue behind one origin."""
+    by_domain: "OrderedDict[str, List[str]]" = OrderedDict()
+    for url in urls:
+        by_domain.setdefault(urlsplit(url).netloc.lower(), []).append(url)
+    queues = list(by_domain.values())
+    interleaved = []
+    for position in range(max((len(queue) for queue in queues), default=0)):
+        interleaved.extend(queue[position] for queue in queues if position < len(queue))
+    return interleaved
+
+class PolitenessScheduler:
+    def __init__(self, rate: float = 2.0, burst: float = 4.0, robots_ttl: float = 3600.0,
+                 max_backoff: float = 300.0, max_retries: int = 3, respect_robots: bool = False,
+                 honour_crawl_delay: bool = False, rate_overrides: Optional[Dict[str, float]] = None,
+                 user_agent: str = "*"):
+        self.rate = rate
+        self.burst = burst
+        self.robots_ttl = robots_ttl
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self.respect_robots = respect_robots
+        self.honour_crawl_delay = honour_crawl_delay
+        self.rate_overrides = rate_overrides or {}
+        self.user_agent = user_agent
+        self.domains: Dict[str, DomainState] = {}
+
+    def _state(self, url: str) -> DomainState:
+        domain = urlsplit(url).netloc.lower()
+        if domain not in self.domains:
+            self.domains[domain] = DomainState(self.rate_overrides.get(domain, self.rate), self.burst)
+        return self.domains[domain]
+
+    async def _load_robots(self, url: str, state: DomainState):
+        async with state.robots_lock:
+            if state.robots is not None and time.time() - state.robots_fetched_at < self.robots_ttl:
+                return
+            from http_client import get_origin_client
+            parts = urlsplit(url)
+            robots_url = f"{parts.scheme}://{parts.netloc}/robots.txt"
+            robots = RobotFileParser(robots_url)
+            try:
+                response = await get_origin_client().get(robots_url)
+                if response.status_code >= 400:
+                    robots.parse([])  # No robots.txt means everything is allowed
+                else:
+                    robots.parse(response.text.splitlines())
+            except Exception as e:
+                logger.warning(f"Could not fetch {robots_url}: {str(e)}")
+                robots.parse([])
+            state.robots = robots
+            state.robots_fetched_at = time.time()
+            delay = robots.crawl_delay(self.user_agent)
+            state.crawl_delay = float(delay) if delay else None
+            if state.crawl_delay:
+                logger.info(f"Honouring crawl-delay of {state.crawl_delay}s for {parts.netloc}")
+
+    async def allowed(self, url: str) -> bool:
+        """robots.txt is only fetched when its Disallow rules (respect_robots) or crawl-delay are honoured."""
+        if not self.respect_robots and not self.honour_crawl_delay:
+            return True
+        state = self._state(url)
+        await self._load_robots(url, state)
+        return not self.respect_robots or state.robots.can_fetch(self.user_agent, url)
+
+    async def acquire(self, url: str):
+        """Wait for this domain's penalty window and rate budget before a request."""
+        state = self._state(url)
+        delay = state.penalty_until - time.monotonic()
+        if delay > 0:
+            logger.info(f"Backing off {delay:.1f}s before requesting {url}")
+            await asyncio.sleep(delay)
+        await state.bucket.acquire(state.rate)
+
+    def record(self, url: str, status_code: int, headers=None) -> Optional[float]:
+        """Adapt the domain's rate to a response; returns the backoff applied, if any."""
+        state = self._state(url)
+        if status_code in RETRY_STATUSES:
+            state.consecutive_failures += 1
+            state.rate_factor = max(state.rate_factor / 2, 1 / 16)
+            retry_after = parse_retry_after(headers.get("retry-after") if headers is not None else None)
+            backoff = retry_after if retry_after is not None else 2 ** state.consecutive_failures
+            backoff = min(backoff, self.max_backoff)
+            state.penalty_until = max(state.penalty_until, time.monotonic() + backoff)
+            logger.warning(f"{status_code} from {urlsplit(url).netloc}; backing off {backoff:.1f}s at {state.rate:.2f} req/s")
+            return backoff
+        state.consecutive_failures = 0
+        state.rate_factor = min(1.0, state.rate_factor + 0.1)
+        return None
+
+    async def fetch(self, url: str, headers: dict = None) -> httpx.Response:
+        """GET an origin URL within its domain's budget, retrying 429/503 after the advertised delay."""
+        from http_client import get_origin_client
+        if not await self.allowed(url):
+            raise RobotsDisallowed(f"robots.txt disallows {url}")
+        client = get_origin_client()
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(url)
+            response = await client.get(url, headers=headers)
+            self.record(url, response.status_code, response.headers)
+            if response.status_code not in RETRY_STATUSES:
+                break
+        return response
+
+    @asynccontextmanager
+    async def stream(self, url: str, headers: dict = None):
+        """Like fetch, but yields the response unread so callers can stop partway through the body."""
+        from http_client import get_origin_client
+        if not await self.allowed(url):
+            raise RobotsDisallowed(f"robots.txt disallows {url}")
+        client = get_origin_client()
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(url)
+            async with client.stream("GET", url, headers=headers) as response:
+                self.record(url, response.status_code, response.headers)
+                if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                    continue
+                yield response
+                return
+
+    def stats(self) -> dict:
+        return {
+            domain: {"rate": round(state.rate, 3), "crawl_delay": state.crawl_delay,
+                     "consecutive_failures": state.consecutive_failures}
+            for domain, state in self.domains.items()
+        }
+
+_scheduler: Optional[PolitenessScheduler] = None
+
+def get_scheduler() -> PolitenessScheduler:
+    global _scheduler
+    if _scheduler is None:
+        from http_client import READER_BASE_URL
+        _scheduler = PolitenessScheduler(
+            rate=float(os.getenv("POLITENESS_RATE", 2.0)),
+            burst=float(os.getenv("POLITENESS_BURST", 4.0)),
+            robots_ttl=float(os.getenv("POLITENESS_ROBOTS_TTL", 3600)),
+            max_backoff=float(os.getenv("POLITENESS_MAX_BACKOFF", 300)),
+            max_retries=int(os.getenv("POLITENESS_MAX_RETRIES", 3)),
+            # Both opt-in: the URLs here are fetched on a user's behalf, not crawled, and robots.txt costs a GET per domain
+            respect_robots=os.getenv("POLITENESS_RESPECT_ROBOTS", "0") != "0",
+            honour_crawl_delay=os.getenv("POLITENESS_CRAWL_DELAY", "0") != "0",
+            # The reader service has its own, much larger, budget
+            rate_overrides={urlsplit(READER_BASE_URL).netloc: float(os.getenv("READER_RATE", 10.0))}
+        )
+    return _scheduler
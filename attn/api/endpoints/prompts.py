@@ -1,10 +1,41 @@
 # This module manages different types of prompts.
+import os
+import string
+import hashlib
+import json
 import logging
+from typing import Dict, List, Optional, Tuple
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+
+JSON_SYSTEM_PROMPT = "Always respond with a structured, valid JSON, adhering strictly to the provided example format. Do not include any other text or explanations outside of the JSON structure."
+
+# Prefix prompts hold everything that is the same from one article to the next. They are sent
+# as a separate system block marked for prompt caching, so only the article text is new input.
+STRUCTURE_INSTRUCTIONS = """
+        Extract the following structured information from {scope}.
+        Use the `{tool}` tool to extract the following information:
+        - Author: Extract the author of the article.
+        - Published Date: Extract the published date of the article.
+        - Entities: Extract entities mentioned in the article, categorized by type and value.
+        - Location: Extract locations mentioned in the article using ISO3 codes.
+        - Main Idea: Extract the main idea of the article.
+        - Assertions: Extract assertions made in the article, categorized by type and value.
+        - Summary: Provide a brief summary of the article.
+        """
+
+# Still a template after {tool} and {scope} are filled in: {topics} is rendered per schema
+SCORE_INSTRUCTIONS = """
+        Use the `{tool}` tool to score {scope} based on the provided topics on a scale of 0-1.
+        Give a score for every topic, keyed by the topic name exactly as given.
+
+        Topics to score:
+        {topics}
+        """
+
 prompts = {
     "generate_urls": {
-        "system_prompt": "Always respond with a structured, valid JSON, adhering strictly to the provided example format. Do not include any other text or explanations outside of the JSON structure.",
+        "system_prompt": JSON_SYSTEM_PROMPT,
         "message_prompt": """
         Please provide a response in the following structured JSON format:
 
@@ -32,18 +63,19 @@ prompts = {
 
         """
     },
-    "extract_article_urls": {
-        "system_prompt": "Always respond with a structured, valid JSON, adhering strictly to the provided example format. Do not include any other text or explanations outside of the JSON structure.",
+    "rerank_article_urls": {
+        "system_prompt": JSON_SYSTEM_PROMPT,
         "message_prompt": """
-        Analyze the following article metadata and content to extract relevant article URLs:
+        The following article URLs were found on this page:
 
         URL: {url}
         Title: {title}
-        Keywords: {keywords}
         Description: {description}
-        Content: {content}
 
-        Return a list of {num_urls} article URLs from the content that is relevant to the topics '{query}' for a user with the following profile:
+        Candidate URLs:
+        {candidates}
+
+        Select up to {num_urls} of the candidate URLs, most relevant first, that are relevant to the topics '{query}' for a user with the following profile:
         - Preferred Name: {preferred_name}
         - Country of Residence: {country_of_residence}
         - Age: {age}
@@ -52,125 +84,153 @@ prompts = {
         - Interests: {interests}
         - Goals: {goals}
 
-        Please provide a response in the following structured JSON format:
+        Only return URLs from the candidate list, unchanged. Please provide a response in the following structured JSON format:
 
         {{
-          "parent_url": {url},
-          "article_urls": [
+          "urls": [
             {{
               "url": "https://masterdomain.com/section/article1link"
             }},
             ...
           ]
         }}
-
-        The URLs should be relevant for a personalized news digest based on the user's profile and the topics of interest.
         """
     },
     "extract_structure": {
-        "system_prompt": "Always respond with a structured, valid JSON, adhering strictly to the provided example format. Do not include any other text or explanations outside of the JSON structure.",
+        "system_prompt": JSON_SYSTEM_PROMPT,
+        "prefix_prompt": STRUCTURE_INSTRUCTIONS.format(tool="extract_structure", scope="the article content"),
         "message_prompt": """
-        Extract the following structured information from the article content:
-
         URL: {url}
         Title: {title}
         Keywords: {keywords}
         Description: {description}
         Content: {content}
-
-        Use the `extract_structure` tool to extract the following information:
-        - Author: Extract the author of the article.
-        - Published Date: Extract the published date of the article.
-        - Entities: Extract entities mentioned in the article, categorized by type and value.
-        - Location: Extract locations mentioned in the article using ISO3 codes.
-        - Main Idea: Extract the main idea of the article.
-        - Assertions: Extract assertions made in the article, categorized by type and value.
-        - Summary: Provide a brief summary of the article.
-
-        Provide the response in the following structured JSON format:
-
-        {{
-          "author": "",
-          "published_date": "",
-          "entities": [
-            {{
-              "type": "",
-              "value": ""
-            }},
-            ...
-          ],
-          "location": "",
-          "main_idea": "",
-          "assertions": [
-            {{
-              "type": "",
-              "value": ""
-            }},
-            ...
-          ],
-          "summary": ""
-        }}
+        """
+    },
+    "extract_structure_batch": {
+        "system_prompt": JSON_SYSTEM_PROMPT,
+        "prefix_prompt": STRUCTURE_INSTRUCTIONS.format(tool="extract_structures", scope="each article below, returning its URL exactly as given"),
+        "message_prompt": """
+        {articles}
+        """
+    },
+    "score_articles_batch": {
+        "system_prompt": JSON_SYSTEM_PROMPT,
+        "prefix_prompt": SCORE_INSTRUCTIONS.replace("{tool}", "score_articles").replace("{scope}", "each article below, returning its URL exactly as given"),
+        "message_prompt": """
+        {articles}
         """
     },
     "score_article": {
-        "system_prompt": "Always respond with a structured, valid JSON, adhering strictly to the provided example format. Do not include any other text or explanations outside of the JSON structure.",
+        "system_prompt": JSON_SYSTEM_PROMPT,
+        "prefix_prompt": SCORE_INSTRUCTIONS.replace("{tool}", "score_article").replace("{scope}", "the article content"),
         "message_prompt": """
-        Use the `score_article` tool to score the following article content based on the provided topics on a scale of 0-1:
-
         URL: {url}
         Title: {title}
         Keywords: {keywords}
         Description: {description}
         Content: {content}
-
-        Topics to score:
-        {topics}
-
-        Provide the response in the following structured JSON format:
-
-        {{
-        "url": "{url}",
-        "scores": {{
-        }}
-        }}
         """
     }
 }
 
-def get_prompts(function_name, request, **kwargs):
-    logger.info(f"Get Prompts - Received request {request} with kwargs: {kwargs}")  # Log the contents of kwargs
+# Prompt bodies (full articles) are only logged when asked for, and then only the first LOG_PROMPTS_MAX_CHARS
+LOG_PROMPTS = os.getenv("LOG_PROMPTS", "0") == "1"
+LOG_PROMPTS_MAX_CHARS = int(os.getenv("LOG_PROMPTS_MAX_CHARS", 2000))
 
-    system_prompt = prompts[function_name].get("system_prompt", "")
-
-    # List of possible attributes to check
-    possible_attributes = [
-        "num_urls", "query", "preferred_name", "country_of_residence", "age",
-        "job_title", "job_function", "interests", "goals", "topics"
-    ]
-
-    # Prepare a dictionary with all possible parameters
-    params = {}
-    for attr in possible_attributes:
-        if hasattr(request, attr):
-            params[attr] = getattr(request, attr)
-        elif hasattr(request, "user_profile") and hasattr(request.user_profile, attr):
-            params[attr] = getattr(request.user_profile, attr)
-
-    # Include additional keyword arguments
-    params.update(kwargs)
+# Fields filled from the request, or from request.user_profile, when not passed as keyword arguments
+REQUEST_FIELDS = {
+    "num_urls", "query", "preferred_name", "country_of_residence", "age",
+    "job_title", "job_function", "interests", "goals", "topics"
+}
 
-    # Filter out None values
-    params = {k: v for k, v in params.items() if v is not None}
+def clip(text: str, limit: int = LOG_PROMPTS_MAX_CHARS) -> str:
+    return text if len(text) <= limit else f"{text[:limit]}... [{len(text) - limit} more characters]"
+
+class PromptTemplate:
+    """A prompt parsed once at import: its fields are known up front and rendering is a single join."""
+
+    def __init__(self, name: str, system_prompt: str, message_prompt: str, prefix_prompt: str = "", version: Optional[str] = None):
+        self.name = name
+        self.system_prompt = system_prompt
+        self.prefix = self._compile(prefix_prompt)
+        self.message = self._compile(message_prompt)
+        fields = [field for _, field, _ in self.prefix + self.message if field is not None]
+        self.fields: List[str] = list(dict.fromkeys(fields))
+        source = json.dumps([system_prompt, prefix_prompt, message_prompt])
+        # Hash of the template text unless pinned explicitly; caches key on it
+        self.version = version or hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+
+    def _compile(self, template: str) -> List[Tuple[str, Optional[str], str]]:
+        segments = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if field is not None and (not field.isidentifier() or conversion):
+                raise ValueError(f"Prompt {self.name}: only plain named fields are supported, got {{{field}}}")
+            segments.append((literal, field, spec or ""))
+        return segments
+
+    def params(self, request, kwargs: dict) -> dict:
+        params = {}
+        profile = getattr(request, "user_profile", None)
+        for field in self.fields:
+            if field in kwargs:
+                value = kwargs[field]
+            elif field in REQUEST_FIELDS:
+                value = getattr(request, field, None)
+                if value is None:
+                    value = getattr(profile, field, None)
+            else:
+                value = None
+            if value is not None:
+                params[field] = value
+        missing = [field for field in self.fields if field not in params]
+        if missing:
+            logger.error(f"Missing key in parameters for formatting {self.name}: {missing}")
+            raise KeyError(missing[0])
+        return params
+
+    @staticmethod
+    def _render(segments, params: dict) -> str:
+        return "".join(
+            literal + (format(params[field], spec) if field is not None else "")
+            for literal, field, spec in segments
+        )
+
+    def render(self, request, **kwargs) -> Tuple[str, str, str]:
+        params = self.params(request, kwargs)
+        prefix_prompt = self._render(self.prefix, params)
+        message_prompt = self._render(self.message, params)
+        if LOG_PROMPTS:
+            logger.info(f"Prompt {self.name} v{self.version} prefix: {clip(prefix_prompt)}")
+            logger.info(f"Prompt {self.name} v{self.version} message: {clip(message_prompt)}")
+        else:
+            logger.debug(f"Rendered prompt {self.name} v{self.version}: {len(prefix_prompt) + len(message_prompt)} characters")
+        return self.system_prompt, prefix_prompt, message_prompt
+
+templates: Dict[str, PromptTemplate] = {
+    name: PromptTemplate(
+        name,
+        spec.get("system_prompt", ""),
+        spec["message_prompt"],
+        spec.get("prefix_prompt", ""),
+        spec.get("version")
+    )
+    for name, spec in prompts.items()
+}
 
-    logger.debug(f"Formatted parameters for prompt: {params}")
+def get_template(function_name) -> PromptTemplate:
+    return templates[function_name]
 
-    try:
-        message_prompt = prompts[function_name]["message_prompt"].format(**params)
-    except KeyError as e:
-        logger.error(f"Missing key in parameters for formatting: {e}")
-        raise
-    except Exception as e:
-        logger.error(f"Error formatting message prompt: {e}")
-        raise
+def prompt_version(function_name):
+    """Version of a function's templates, so cached responses are dropped when a template is edited."""
+    return templates[function_name].version
 
+def get_prompts(function_name, request, **kwargs):
+    system_prompt, prefix_prompt, message_prompt = get_prompt_parts(function_name, request, **kwargs)
+    if prefix_prompt:
+        system_prompt = f"{system_prompt}\n{prefix_prompt}"
     return system_prompt, message_prompt
+
+def get_prompt_parts(function_name, request, **kwargs):
+    """Render (system prompt, cacheable prefix, per-call message); the prefix is "" for prompts without one."""
+    return templates[function_name].render(request, **kwargs)
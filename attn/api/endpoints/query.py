@@ -37,6 +37,7 @@ class QueryRequest(BaseModel):
     user_profile: Optional[UserProfile] = None
     models: List[str] = ["claude-3-opus-20240229"]
     num_urls: int = 20
+    cascade: bool = False  # Try models in order (or LLM_CASCADE_MODELS), escalating when fewer than num_urls come back
 
     @validator('query')
     def ensure_string(cls, value):
@@ -78,17 +79,25 @@ async def query(request: QueryRequest):
 
     # Importing modules from endpoints
     try:
-        from llm_handler import LLMHandler
+        from llm_handler import get_llm_handler
         from prompts import get_prompts
+        from tools import require_urls
+        from canonical import dedupe_urls
     except ImportError as e:
         logger.error(f"Failed to import modules from endpoints: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to import required modules")
 
     try:
-        llm_handler = LLMHandler()
-        system_prompt, message_prompt = get_prompts("generate_urls", request)
-        response_text = llm_handler.call_llm("generate_urls", request)
-        urls = parse_urls_from_response(response_text, request.num_urls)
+        llm_handler = get_llm_handler()
+        if request.cascade:
+            output = await llm_handler.acall_tool_cascade(
+                "generate_urls", request,
+                models=request.models if len(request.models) > 1 else None,
+                validate=require_urls(request.num_urls)
+            )
+        else:
+            output = await llm_handler.acall_tool("generate_urls", request)
+        urls = dedupe_urls([item.url for item in output.urls])[:request.num_urls]
 
         async def stream_urls():
             yield f"Query received: {request.query}\n"
@@ -99,25 +108,3 @@ async def query(request: QueryRequest):
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
-
-def parse_urls_from_response(text: str, num_urls: int) -> List[str]:
-    try:
-        data = json.loads(text)
-        urls = [item['url'] for item in data['urls'][:num_urls]]
-        logger.info(f"URLs parsed from response: {urls}")
-        return urls
-    except (json.JSONDecodeError, KeyError) as e:
-        logger.error(f"Error parsing URLs from response: {str(e)}")
-        # Try to extract URLs using a fallback approach
-        urls = extract_urls_fallback(text, num_urls)
-        logger.info(f"URLs parsed using fallback approach: {urls}")
-        return urls
-
-def extract_urls_fallback(text: str, num_urls: int) -> List[str]:
-    # Implement a fallback approach to extract URLs from the text
-    # This could involve using regular expressions or other string manipulation techniques
-    # to extract the URLs even if the JSON is not properly formatted
-    # Example implementation:
-    import re
-    urls = re.findall(r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+', text)
-    return urls[:num_urls]
@@ -36,6 +36,8 @@ class QueryRequest(BaseModel):
     user_profile: Optional[UserProfile] = None
     models: List[str] = ["claude-3-opus-20240229"]
     num_urls: int = 20
+    cascade: bool = False  # Try models in order (or LLM_CASCADE_MODELS), escalating when fewer than num_urls come back
+    stream: bool = True  # Send each URL as soon as the model has written it
 
     @validator('query')
     def ensure_string(cls, value):
@@ -81,17 +83,63 @@ async def query_v2(request: QueryRequest):
 
     # Importing modules from endpoints
     try:
-        from llm_handler import LLMHandler
+        from llm_handler import get_llm_handler
         from prompts import get_prompts
+        from tools import require_urls
+        from canonical import canonicalize_url, dedupe_urls
+        from json_stream import IncrementalObjectParser
     except ImportError as e:
         logger.error(f"Failed to import modules from endpoints: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to import required modules")
 
     try:
-        llm_handler = LLMHandler()
-        system_prompt, message_prompt = get_prompts("generate_urls", request)
-        response_text = llm_handler.call_llm("generate_urls", request)
-        urls = parse_urls_from_response(response_text, request.num_urls)
+        llm_handler = get_llm_handler()
+        if request.stream:
+            deltas = llm_handler.astream_llm("generate_urls", request)
+            # Wait for the first delta so a failed call still surfaces as a 500 instead of an empty stream
+            first_delta = await deltas.__anext__()
+
+            async def stream_urls():
+                yield f"Query received: {request.query}\n"
+                yield f"User profile: {json.dumps(request.user_profile.dict())}\n"
+                parser = IncrementalObjectParser(required_key="url")
+                seen = set()
+
+                def fresh(objects):
+                    for obj in objects:
+                        key = canonicalize_url(str(obj["url"]))
+                        if key not in seen and len(seen) < request.num_urls:
+                            seen.add(key)
+                            yield obj["url"]
+
+                try:
+                    for url in fresh(parser.feed(first_delta)):
+                        yield f"{url}\n"
+                    async for delta in deltas:
+                        if len(seen) >= request.num_urls:
+                            break  # Enough URLs; stop paying for the rest of the generation
+                        for url in fresh(parser.feed(delta)):
+                            yield f"{url}\n"
+                except Exception as e:
+                    logger.error(f"URL stream stopped early: {str(e)}")
+                finally:
+                    # Closes the upstream response if the loop ended early or the client went away
+                    await deltas.aclose()
+                if not seen:
+                    # Nothing parsed incrementally; fall back to the lenient whole-response parsing
+                    for url in dedupe_urls(parse_urls_from_response(parser.text, request.num_urls)):
+                        yield f"{url}\n"
+            return StreamingResponse(stream_urls(), media_type="text/plain")
+
+        if request.cascade:
+            output = await llm_handler.acall_tool_cascade(
+                "generate_urls", request,
+                models=request.models if len(request.models) > 1 else None,
+                validate=require_urls(request.num_urls)
+            )
+        else:
+            output = await llm_handler.acall_tool("generate_urls", request)
+        urls = dedupe_urls([item.url for item in output.urls])[:request.num_urls]
 
         async def stream_urls():
             yield f"Query received: {request.query}\n"
@@ -0,0 +1,143 @@
+# Per-model requests-per-minute and tokens-per-minute budgets for LLM calls.
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token for English prose; errs towards over-reserving
+CHARS_PER_TOKEN = 3.5
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+    return sum(math.ceil(len(text) / CHARS_PER_TOKEN) for text in texts if text)
+
+class ModelBudget:
+    """Two continuously refilling buckets, one for requests and one for tokens, shared FIFO by all callers."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = rpm
+        self.tokens = tpm
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self.wait_times = deque(maxlen=500)
+        self.total_calls = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+        self.updated = now
+
+    async def acquire(self, tokens: int):
+        # A single call larger than the whole budget can never fit; let it through once the bucket is full
+        tokens = min(tokens, self.tpm)
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    self._refill()
+                    delay = self.blocked_until - time.monotonic()
+                    if delay <= 0:
+                        if self.requests >= 1 and self.tokens >= tokens:
+                            self.requests -= 1
+                            self.tokens -= tokens
+                            break
+                        delay = max(
+                            (1 - self.requests) * 60 / self.rpm if self.requests < 1 else 0,
+                            (tokens - self.tokens) * 60 / self.tpm if self.tokens < tokens else 0
+                        )
+                    await asyncio.sleep(delay)
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - started
+        self.wait_times.append(waited)
+        self.total_calls += 1
+        if waited > 1:
+            logger.info(f"Waited {waited:.1f}s for rate budget ({self.waiting} calls still queued)")
+
+    def try_acquire(self, tokens: int) -> bool:
+        """Take the budget for one call only if it is available now and nobody is queued for it."""
+        tokens = min(tokens, self.tpm)
+        if self.waiting or self._lock.locked():
+            return False
+        self._refill()
+        if time.monotonic() < self.blocked_until or self.requests < 1 or self.tokens < tokens:
+            return False
+        self.requests -= 1
+        self.tokens -= tokens
+        self.total_calls += 1
+        return True
+
+    def settle(self, reserved: int, used: int):
+        """Return the part of a reservation the call didn't use (usually most of max_tokens)."""
+        self._refill()
+        self.tokens = min(self.tpm, self.tokens + max(0, reserved - used))
+
+    def pause(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def metrics(self) -> dict:
+        waits = sorted(self.wait_times)
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "queue_depth": self.waiting,
+            "calls": self.total_calls,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+            "paused_for": max(0.0, self.blocked_until - time.monotonic())
+        }
+
+class RateLimiter:
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None, default_rpm: float = 50, default_tpm: float = 40000):
+        self.limits = limits or {}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.budgets: Dict[str, ModelBudget] = {}
+
+    def budget(self, model: str) -> ModelBudget:
+        if model not in self.budgets:
+            limits = self.limits.get(model, {})
+            self.budgets[model] = ModelBudget(limits.get("rpm", self.default_rpm), limits.get("tpm", self.default_tpm))
+        return self.budgets[model]
+
+    async def acquire(self, model: str, tokens: int):
+        await self.budget(model).acquire(tokens)
+
+    def try_acquire(self, model: str, tokens: int) -> bool:
+        return self.budget(model).try_acquire(tokens)
+
+    def settle(self, model: str, reserved: int, used: int):
+        self.budget(model).settle(reserved, used)
+
+    def pause(self, model: str, seconds: float):
+        logger.warning(f"Pausing calls to {model} for {seconds:.1f}s")
+        self.budget(model).pause(seconds)
+
+    def metrics(self) -> dict:
+        return {model: budget.metrics() for model, budget in self.budgets.items()}
+
+_rate_limiter: Optional[RateLimiter] = None
+
+def get_rate_limiter() -> RateLimiter:
+    """Configured from LLM_RATE_LIMITS, e.g. '{"claude-3-haiku-20240307": {"rpm": 50, "tpm": 50000}}'."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(
+            limits=json.loads(os.getenv("LLM_RATE_LIMITS", "{}")),
+            default_rpm=float(os.getenv("LLM_DEFAULT_RPM", 50)),
+            default_tpm=float(os.getenv("LLM_DEFAULT_TPM", 40000))
+        )
+    return _rate_limiter
@@ -1,17 +1,18 @@
-from bs4 import BeautifulSoup
 import httpx
 import asyncio
 from datetime import datetime
+from urllib.parse import urljoin
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, validator
+from typing import List, Optional
 import modal
 from modal import Image, App, web_endpoint, Secret, Mount
 from fastapi.responses import StreamingResponse
 import logging
 import json
-import backoff
 import re
+import sys
+import os
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -25,12 +26,18 @@ app_image = (
         "anthropic",
         "bs4",
         "lxml",
-        "backoff"
+        "httpx[http2]"
     )
 )
 
 app = App(name="read-svc", image=app_image, secrets=[Secret.from_name("my-anthropic-secret")])
 
+# "dual" is the original behaviour: content from the reader service plus a separate origin GET for
+# metadata. "reader" takes everything from the reader payload; the others run locally over origin HTML.
+READ_ENGINES = ["dual", "reader", "bs4", "trafilatura"]
+# Upper bound on the article text kept in memory for repeat reads within the dedup TTL
+READ_DEDUP_MAX_BYTES = int(os.getenv("READ_DEDUP_MAX_BYTES", 50 * 1024 * 1024))
+
 class ArticleData(BaseModel):
     url: str
     accessed_date: datetime
@@ -40,50 +47,281 @@ class ArticleData(BaseModel):
     content: str
     article_urls: List[str]
     status: str
+    canonical_url: Optional[str] = None
+    og_title: Optional[str] = None
+    published_time: Optional[str] = None
+    language: Optional[str] = None
+
+def article_size(article: ArticleData) -> int:
+    """Rough in-memory size of an article: its text fields, which dwarf the rest."""
+    return sum(len(text) for text in (article.title, article.description, article.content)) + sum(len(url) for url in article.article_urls)
 
 class ReadRequest(BaseModel):
     urls: List[str]
+    max_concurrency: int = 10  # Global limit on URLs fetched at once; 1 reads sequentially
+    per_host_limit: int = 2  # Limit on concurrent fetches against the same host
+    preserve_order: bool = False  # Stream in input order instead of as each URL finishes
+    engine: str = "dual"  # "dual", "reader" (reader payload only) or a local engine: "bs4", "trafilatura"
+    use_cache: bool = True  # Serve and store articles through the on-disk article cache
+
+    @validator('engine')
+    def check_engine(cls, value):
+        if value not in READ_ENGINES:
+            raise ValueError(f"engine must be one of {READ_ENGINES}")
+        return value
 
 class ReadResponse(BaseModel):
     articles: List[ArticleData]
 
+class ReadJobRequest(BaseModel):
+    urls: List[str]
+    engine: str = "dual"
+    workers: int = 10  # Number of URLs fetched in parallel by the job
+
+    @validator('engine')
+    def check_engine(cls, value):
+        if value not in READ_ENGINES:
+            raise ValueError(f"engine must be one of {READ_ENGINES}")
+        return value
+
 # class ReadRequest(BaseModel):
 #     urls: List[str]
 
 # class ReadResponse(BaseModel):
 #     articles: List[ArticleData]
 
-router = APIRouter()
+async def _startup_http_clients():
+    from http_client import startup
+    await startup()
 
-@app.function()
+async def _shutdown_http_clients():
+    from http_client import shutdown
+    await shutdown()
+
+async def _resume_read_jobs():
+    from jobs import resume_jobs
+    resume_jobs(fetch_for_job)
+
+# Apps that include this router open and close the pooled HTTP clients with their lifecycle
+# and pick up any bulk read jobs left unfinished by a previous process
+router = APIRouter(
+    on_startup=[_startup_http_clients, _resume_read_jobs],
+    on_shutdown=[_shutdown_http_clients]
+)
+
+@app.function(mounts=[
+    Mount.from_local_dir(
+        local_path="/Users/erniesg/code/erniesg/shareshare/attn/api/endpoints",
+        remote_path="/app/endpoints",
+        condition=lambda pth: "read.py" not in pth,
+        recursive=True
+    )
+])
 @web_endpoint(method="POST")
 async def read(request: ReadRequest):
+    sys.path.insert(0, '/app')
+    sys.path.insert(0, '/app/endpoints')
+    from fanout import fan_out, host_of
+    from canonical import dedupe_urls, get_dedup_index
+    from politeness import interleave_by_domain
+
+    # Variants of the same article (tracking params, anchors, trailing slashes...) are fetched once
+    urls = dedupe_urls(request.urls)
+    if len(urls) < len(request.urls):
+        logging.info(f"Collapsed {len(request.urls) - len(urls)} duplicate URLs in read request")
+    if not request.preserve_order:
+        # Spread publishers out so a batch heavy on one host doesn't queue behind its rate limit
+        urls = interleave_by_domain(urls)
+    # use_cache=False asks for fresh reads, so recent results are neither served nor kept
+    recent = get_dedup_index("read", max_bytes=READ_DEDUP_MAX_BYTES, size_of=article_size) if request.use_cache else None
+
+    async def read_one(url: str) -> ArticleData:
+        article = recent.get(url, request.engine) if recent is not None else None
+        if article is not None:
+            logging.info(f"Returning recently read article for URL: {url}")
+            return article.copy(update={"url": url})
+        article = await fetch_and_parse_url(url, engine=request.engine, use_cache=request.use_cache)
+        if article.status == 'read' and recent is not None:
+            recent.put(url, article, request.engine)
+        return article
+
     async def article_stream():
-        for url in request.urls:
-            try:
-                article = await fetch_and_parse_url(url)
-                yield article.json().encode() + b"\n\n"
-            except Exception as e:
-                yield f"Error fetching {url}: {str(e)}\n\n".encode()
-                continue  # or break, depending on desired behavior
+        async for _, url, result in fan_out(
+            urls,
+            read_one,
+            max_concurrency=request.max_concurrency,
+            per_key_limit=request.per_host_limit,
+            key=host_of,
+            preserve_order=request.preserve_order
+        ):
+            if isinstance(result, Exception):
+                yield f"Error fetching {url}: {str(result)}\n\n".encode()
+            else:
+                yield result.json().encode() + b"\n\n"
     return StreamingResponse(article_stream(), media_type="text/event-stream")
 
-async def fetch_and_parse_url(url: str) -> ArticleData:
-    logging.info(f"Initiating parsing for URL: {url}")
+@app.function(mounts=[
+    Mount.from_local_dir(
+        local_path="/Users/erniesg/code/erniesg/shareshare/attn/api/endpoints",
+        remote_path="/app/endpoints",
+        condition=lambda pth: "read.py" not in pth,
+        recursive=True
+    )
+])
+@web_endpoint(method="GET")
+async def read_stats():
+    sys.path.insert(0, '/app')
+    sys.path.insert(0, '/app/endpoints')
+    from article_cache import get_article_cache
+    from canonical import get_dedup_index
+    from politeness import get_scheduler
+    cache = get_article_cache()
+    return {
+        "article_cache": cache.stats() if cache else None,
+        "dedup_index": get_dedup_index("read", max_bytes=READ_DEDUP_MAX_BYTES, size_of=article_size).stats(),
+        "domains": get_scheduler().stats()
+    }
+
+@app.function(mounts=[
+    Mount.from_local_dir(
+        local_path="/Users/erniesg/code/erniesg/shareshare/attn/api/endpoints",
+        remote_path="/app/endpoints",
+        condition=lambda pth: "read.py" not in pth,
+        recursive=True
+    )
+])
+@web_endpoint(method="POST")
+async def read_job(request: ReadJobRequest):
+    sys.path.insert(0, '/app')
+    sys.path.insert(0, '/app/endpoints')
+    from canonical import dedupe_urls
+    from jobs import get_job_store, resume_jobs, start_job
+
+    resume_jobs(fetch_for_job)
+    store = get_job_store()
+    job_id = store.create_job(dedupe_urls(request.urls), engine=request.engine, workers=request.workers)
+    start_job(job_id, fetch_for_job, workers=request.workers)
+    return {"job_id": job_id, "progress": store.progress(job_id)}
+
+@app.function(mounts=[
+    Mount.from_local_dir(
+        local_path="/Users/erniesg/code/erniesg/shareshare/attn/api/endpoints",
+        remote_path="/app/endpoints",
+        condition=lambda pth: "read.py" not in pth,
+        recursive=True
+    )
+])
+@web_endpoint(method="GET")
+async def read_job_status(job_id: str, offset: int = 0, limit: int = 100, state: str = "read"):
+    sys.path.insert(0, '/app')
+    sys.path.insert(0, '/app/endpoints')
+    from jobs import get_job_store
+
+    store = get_job_store()
+    job = store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    results = store.results(job_id, offset=offset, limit=limit, state=state)
+    for result in results:
+        result["article"] = json.loads(result["article"]) if result["article"] else None
+    return {
+        "job_id": job_id,
+        "finished": job["finished_at"] is not None,
+        "progress": store.progress(job_id),
+        "offset": offset,
+        "results": results,
+        "next_offset": offset + len(results) if len(results) == limit else None
+    }
+
+async def fetch_for_job(url: str, engine: str) -> ArticleData:
+    return await fetch_and_parse_url(url, engine=engine)
+
+async def fetch_and_parse_url(url: str, engine: str = "dual", use_cache: bool = True) -> ArticleData:
+    from article_cache import get_article_cache
+    cache = get_article_cache() if use_cache else None
+    if cache is None:
+        article, _ = await read_article(url, engine)
+        return article
+
+    # SQLite calls run in a worker thread so a slow disk doesn't stall every other read on the event loop
+    entry = await asyncio.to_thread(cache.get, url, engine)
+    origin_response = None
+    if entry is not None:
+        if cache.is_fresh(entry):
+            cache.record("hits")
+            logging.info(f"Article cache hit for URL: {url}")
+            return cached_article(entry, url)
+        if entry.etag or entry.last_modified:
+            origin_response = await revalidate(url, entry.etag, entry.last_modified)
+            if origin_response is not None and origin_response.status_code == 304:
+                await asyncio.to_thread(cache.touch, url, engine)
+                cache.record("revalidations")
+                logging.info(f"Article cache revalidated for URL: {url}")
+                return cached_article(entry, url)
+            if origin_response is not None and origin_response.status_code != 200:
+                origin_response = None
+
+    cache.record("misses")
+    article, validators = await read_article(url, engine, origin_response=origin_response)
+    if article.status == 'read':
+        await asyncio.to_thread(cache.put, url, engine, article.json(), **validators)
+    return article
+
+def cached_article(entry, url: str) -> ArticleData:
+    """The cached article as read for `url`; the entry may have been filled through another variant of it."""
+    return ArticleData.parse_raw(entry.article).copy(update={"url": url})
+
+async def revalidate(url: str, etag: str = None, last_modified: str = None) -> httpx.Response:
+    """Conditional GET against the origin; a 304 means the cached article is still current."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
     try:
-        raw_content = await fetch_content(url)
-        logging.info(f"Received raw content: {raw_content} of {type(raw_content)}")
+        return await fetch_html(url, headers=headers)
+    except Exception as e:
+        logging.error(f"Failed to revalidate {url}: {str(e)}")
+        return None
+
+async def read_article(url: str, engine: str = "dual", origin_response: httpx.Response = None):
+    """Fetch and parse one article, returning it with the origin's ETag/Last-Modified validators.
 
-        # Split the content into lines and filter for lines starting with 'data:'
-        json_str = next(line for line in raw_content.split('\n') if line.startswith('data:')).strip()[5:]
-        # Join the filtered lines and parse as JSON
-        content_data = json.loads(json_str)
-        content = content_data['content']
+    A 200 `origin_response` left over from revalidation is reused instead of fetching the origin again.
+    """
+    from html_extract import LOCAL_ENGINES, extract_text
+    from head_meta import extract_head_metadata
+    from links import extract_article_links
+    logging.info(f"Initiating parsing for URL: {url} with engine: {engine}")
+    validators = {}
+    try:
+        if engine in LOCAL_ENGINES:
+            # One origin GET: metadata and text both come from the same HTML
+            response = origin_response or await fetch_html(url)
+            metadata = extract_head_metadata(response.text)
+            content = extract_text(response.text, engine, url=url)
+            article_urls = extract_article_links(url, html=response.text)
+            validators = validators_from(response)
+        else:
+            content_data = await fetch_content(url)
+            if content_data is None:
+                raise ValueError("Reader returned no content event")
+            content = content_data['content']
+            logging.info(f"Received {len(content)} characters of content for URL: {url}")
+            # The reader keeps the page's links as markdown, so anchors can be recovered from the content
+            article_urls = extract_article_links(url, markdown=content)
 
-        metadata = await fetch_metadata(url)
+            if engine == "reader":
+                metadata = metadata_from_reader(content_data)
+            else:
+                metadata = await fetch_metadata(url, response=origin_response)
+                validators = metadata.get('validators', {})
         title = metadata['title']
         keywords = metadata['keywords']
         description = metadata['description']
+        head_fields = {key: metadata.get(key) for key in ('canonical_url', 'og_title', 'published_time', 'language')}
+        if head_fields['canonical_url']:
+            head_fields['canonical_url'] = urljoin(url, head_fields['canonical_url'])
 
         # Check if both title and content are not empty
         if title != 'No title found' and content.strip():
@@ -99,79 +337,102 @@ async def fetch_and_parse_url(url: str) -> ArticleData:
         keywords = []
         content = "Content could not be parsed"
         status = 'error'
+        article_urls = []
+        head_fields = {}
 
-    return ArticleData(
+    article = ArticleData(
         url=url,
         accessed_date=datetime.now(),
         title=title,
         keywords=keywords,
         description=description,
         content=content,
-        article_urls=[],  # Placeholder for future enhancement
-        status=status
+        article_urls=article_urls,
+        status=status,
+        **head_fields
     )
+    return article, validators
 
-async def fetch_metadata(url: str) -> dict:
-    logging.info(f"Fetching metadata for URL: {url}")
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36",
-        "Referer": "https://www.google.com/"
+def metadata_from_reader(content_data: dict) -> dict:
+    keywords = content_data.get('keywords') or []
+    if isinstance(keywords, str):
+        keywords = keywords.split(',')
+    return {
+        'title': (content_data.get('title') or '').strip() or 'No title found',
+        'description': (content_data.get('description') or '').strip() or 'No description found',
+        'keywords': keywords
     }
-    async with httpx.AsyncClient(follow_redirects=True, headers=headers) as client:
-        try:
-            response = await client.get(url, headers=headers)
-            soup = BeautifulSoup(response.text, 'lxml')
-
-            # Extract title
-            title_tag = soup.find('title')
-            title = title_tag.text if title_tag else 'No title found'
-            logging.info(f"Extracted title: {title}")
-
-            # Extract description
-            meta_description = soup.find('meta', attrs={'name': 'description', 'content': True})
-            description = meta_description['content'].strip() if meta_description else 'No description found'
-            if description == 'No description found':
-                og_description = soup.find('meta', attrs={'property': 'og:description', 'content': True})
-                description = og_description['content'].strip() if og_description else description
-            logging.info(f"Extracted description: {description}")
-
-            # Extract keywords
-            meta_keywords = soup.find('meta', attrs={'name': 'keywords', 'content': True})
-            keywords = meta_keywords['content'].split(',') if meta_keywords and meta_keywords['content'] else []
-            logging.info(f"Keywords: {keywords}")
-
-            # Return a structured dictionary that matches the ArticleData fields
-            return {
-                'title': title,
-                'description': description,
-                'keywords': keywords
-            }
-        except Exception as e:
-            logging.error(f"Failed to fetch metadata for {url}: {str(e)}")
-            return {
-                'title': 'No title found',
-                'description': 'No description found',
-                'keywords': []
-            }
-
-@backoff.on_exception(backoff.expo, httpx.HTTPError, max_tries=3)
-async def fetch_content(url: str) -> str:
+
+def validators_from(response: httpx.Response) -> dict:
+    return {
+        'etag': response.headers.get('etag'),
+        'last_modified': response.headers.get('last-modified')
+    }
+
+async def fetch_html(url: str, headers: dict = None) -> httpx.Response:
+    from politeness import get_scheduler
+    return await get_scheduler().fetch(url, headers=headers)
+
+async def fetch_metadata(url: str, response: httpx.Response = None) -> dict:
+    from head_meta import extract_head_metadata, stream_head_metadata
+    from politeness import get_scheduler
+    logging.info(f"Fetching metadata for URL: {url}")
+    try:
+        if response is not None:
+            metadata = extract_head_metadata(response.text)
+        else:
+            # Only the <head> is needed; stop downloading once it has been parsed
+            async with get_scheduler().stream(url) as response:
+                metadata, bytes_read = await stream_head_metadata(
+                    response.aiter_bytes(),
+                    encoding=response.charset_encoding,
+                    max_bytes=int(os.getenv("HEAD_MAX_BYTES", 512 * 1024))
+                )
+            logging.info(f"Read {bytes_read} bytes of {url} for metadata")
+        logging.info(f"Extracted title: {metadata['title']}")
+        metadata['validators'] = validators_from(response)
+        return metadata
+    except Exception as e:
+        logging.error(f"Failed to fetch metadata for {url}: {str(e)}")
+        return {
+            'title': 'No title found',
+            'description': 'No description found',
+            'keywords': []
+        }
+
+async def fetch_content(url: str, max_bytes: int = None) -> dict:
+    """Return the first complete content event from the reader service, or None if there isn't one."""
+    from http_client import READER_BASE_URL, get_reader_client
+    from politeness import RETRY_STATUSES, get_scheduler
+    from sse import iter_sse_events
     logging.info(f"Initiating content fetch for URL: {url}")
-    full_url = f"https://r.jina.ai/{url}"  # Construct the full URL
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        try:
+    full_url = f"{READER_BASE_URL}/{url}"  # Construct the full URL
+    max_bytes = max_bytes or int(os.getenv("READER_MAX_BYTES", 16 * 1024 * 1024))
+    client = get_reader_client()
+    scheduler = get_scheduler()
+    try:
+        for attempt in range(scheduler.max_retries + 1):
+            # Reader requests share one rate budget so retries slow down instead of piling on
+            await scheduler.acquire(full_url)
             logging.info(f"Sending HTTP GET request to stream: {full_url}")
             async with client.stream("GET", full_url, headers={"Accept": "text/event-stream"}) as response:
+                scheduler.record(full_url, response.status_code, response.headers)
+                if response.status_code in RETRY_STATUSES and attempt < scheduler.max_retries:
+                    continue
                 logging.info(f"HTTP stream opened for URL: {full_url}")
-                content = ""
-                line_count = 0
-                async for line in response.aiter_lines():
-                    line_count += 1
-                    content += line + "\n"
-                    if line_count % 250 == 0:  # Log every 250 lines
-                        logging.info(f"Received {line_count} lines so far from URL: {url}")
-                logging.info(f"Completed fetching content from URL: {full_url}. Total lines received: {line_count}")
-                return content
-        except Exception as e:
-            logging.error(f"Failed to fetch content for {url}: {str(e)}")
-            return ""
+                event_count = 0
+                async for event in iter_sse_events(response.aiter_bytes(), max_bytes=max_bytes):
+                    event_count += 1
+                    try:
+                        content_data = json.loads(event.data)
+                    except json.JSONDecodeError:
+                        continue
+                    if isinstance(content_data, dict) and 'content' in content_data:
+                        # Leaving the stream context closes the connection's stream; no need to drain the rest
+                        logging.info(f"Received content event {event_count} from URL: {full_url}")
+                        return content_data
+                logging.error(f"No content event in {event_count} events from URL: {full_url}")
+                return None
+    except Exception as e:
+        logging.error(f"Failed to fetch content for {url}: {str(e)}")
+        return None
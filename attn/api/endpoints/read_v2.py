@@ -31,6 +31,9 @@ class ArticleData(BaseModel):
 
 class ReadRequest(BaseModel):
     urls: List[str]
+    max_concurrency: int = 10
+    per_host_limit: int = 2
+    preserve_order: bool = False
 
 class ReadResponse(BaseModel):
     articles: List[ArticleData]
@@ -59,43 +62,50 @@ app = App(name="query-app")
 @app.function()
 @web_endpoint(method="GET")  # Adjust method as needed
 async def read_urls(request: ReadRequest):
+    from fanout import fan_out, host_of
+
     async def article_stream():
-        for url in request.urls:
-            try:
-                article = await fetch_and_parse_url(url)
-                if article is not None:
-                    yield article.response_content.encode() + b"\n\n"
-                else:
-                    yield f"Error fetching {url}: Article data is None\n\n".encode()
-            except Exception as e:
-                yield f"Error fetching {url}: {str(e)}\n\n".encode()
-                continue  # or break, depending on desired behavior
+        async for _, url, article in fan_out(
+            request.urls,
+            fetch_and_parse_url,
+            max_concurrency=request.max_concurrency,
+            per_key_limit=request.per_host_limit,
+            key=host_of,
+            preserve_order=request.preserve_order
+        ):
+            if isinstance(article, Exception):
+                yield f"Error fetching {url}: {str(article)}\n\n".encode()
+            elif article is not None:
+                yield article.response_content.encode() + b"\n\n"
+            else:
+                yield f"Error fetching {url}: Article data is None\n\n".encode()
     return StreamingResponse(article_stream(), media_type="text/event-stream")
 
 async def fetch_and_parse_url(url: str) -> ArticleData:
+    from http_client import READER_BASE_URL, get_reader_client
     logging.debug(f"Initiating connection to fetch URL: {url}")
-    async with httpx.AsyncClient() as client:
-        try:
-            # Correctly initiate the stream
-            full_url = f"https://r.jina.ai/{url}"
-            logging.debug(f"Sending HTTP GET request to stream: {full_url}")
+    client = get_reader_client()
+    try:
+        # Correctly initiate the stream
+        full_url = f"{READER_BASE_URL}/{url}"
+        logging.debug(f"Sending HTTP GET request to stream: {full_url}")
 
-            async with client.stream("GET", full_url, headers={"Accept": "text/event-stream"}) as response:
-                logging.debug(f"HTTP stream opened for URL: {full_url}")
-                content = ""
-                # Iterate over the lines in the response
-                line_count = 0
-                async for line in response.aiter_lines():
-                    line_count += 1
-                    content += line + "\n"
-                    if line_count % 250 == 0:  # Log every 250 lines
-                        logging.debug(f"Received {line_count} lines so far from URL: {url}")
-                logging.info(f"Completed fetching content from URL: {full_url}. Total lines received: {line_count}")
-                # Process the content as needed
-                return ArticleData(response_content=content)
-        except Exception as e:
-            logging.error(f"Failed to fetch {url}: {str(e)}")
-            return None
+        async with client.stream("GET", full_url, headers={"Accept": "text/event-stream"}) as response:
+            logging.debug(f"HTTP stream opened for URL: {full_url}")
+            lines = []
+            # Iterate over the lines in the response
+            line_count = 0
+            async for line in response.aiter_lines():
+                line_count += 1
+                lines.append(line + "\n")
+                if line_count % 250 == 0:  # Log every 250 lines
+                    logging.debug(f"Received {line_count} lines so far from URL: {url}")
+            logging.info(f"Completed fetching content from URL: {full_url}. Total lines received: {line_count}")
+            # Process the content as needed
+            return ArticleData(response_content="".join(lines))
+    except Exception as e:
+        logging.error(f"Failed to fetch {url}: {str(e)}")
+        return None
 
 async def article_stream():
     for url in request.urls:
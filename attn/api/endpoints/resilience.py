@@ -0,0 +1,124 @@
+# Tail-latency controls for LLM calls: deadlines, hedged duplicate requests and per-model circuit breakers.
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+async def with_deadline(call: Awaitable[T], seconds: Optional[float]) -> T:
+    if not seconds:
+        return await call
+    try:
+        return await asyncio.wait_for(call, seconds)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"No response within {seconds:.1f}s")
+
+async def hedged(make_call: Callable[[], Awaitable[T]], hedge_after: Optional[float], max_hedges: int = 1,
+                 may_hedge: Optional[Callable[[], bool]] = None) -> T:
+    """Run make_call(); if it hasn't finished after hedge_after seconds, race a duplicate against it.
+
+    Hedging only covers slow calls: the first call to finish decides, a success is returned and an
+    error is raised at once, and the others are cancelled. Retrying failures is left to the caller.
+    `may_hedge()` is asked before each duplicate goes out; False stops hedging for this call.
+    """
+    if hedge_after is None:
+        return await make_call()
+    tasks = [asyncio.ensure_future(make_call())]
+    can_hedge = True
+    try:
+        while True:
+            can_hedge = can_hedge and len(tasks) <= max_hedges
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after if can_hedge else None, return_when=asyncio.FIRST_COMPLETED)
+            if done:
+                succeeded = [task for task in done if task.exception() is None]
+                if not succeeded:
+                    raise next(iter(done)).exception()
+                if succeeded[0] is not tasks[0]:
+                    logger.info(f"Hedged request won after {hedge_after:.2f}s")
+                return succeeded[0].result()
+            if may_hedge is not None and not may_hedge():
+                can_hedge = False
+                continue
+            logger.info(f"No response after {hedge_after:.2f}s, sending a hedged request")
+            tasks.append(asyncio.ensure_future(make_call()))
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+class LatencyTracker:
+    """Recent successful-call latencies per key, for picking the hedge delay."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.samples: Dict[str, deque] = {}
+
+    def record(self, key: str, latency: float):
+        self.samples.setdefault(key, deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, key: str, percentile: float, min_samples: int = 20) -> Optional[float]:
+        samples = self.samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+class CircuitBreaker:
+    """Opens when the recent error rate passes a threshold; after a cooldown one trial call decides whether it closes."""
+
+    def __init__(self, error_threshold: float = 0.5, window: int = 20, min_calls: int = 10, cooldown: float = 30.0):
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)  # True for an error
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def abandon(self):
+        """A call let through by allow() ended without an outcome (e.g. it was cancelled)."""
+        self.trial_running = False
+
+    def record(self, error: bool):
+        if self.opened_at is not None:
+            if self.trial_running:
+                self.trial_running = False
+                if error:
+                    self.opened_at = time.monotonic()
+                else:
+                    self.opened_at = None
+                    self.outcomes.clear()
+            return
+        self.outcomes.append(error)
+        if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.error_threshold:
+            self.opened_at = time.monotonic()
+            self.trips += 1
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "recent_error_rate": sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0,
+            "trips": self.trips
+        }
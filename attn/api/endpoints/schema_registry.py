@@ -0,0 +1,141 @@
+# Named scoring schemas, compiled once per file version and reloaded when the file changes on disk.
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from pydantic import Field, ValidationError, conint, create_model
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.getenv("SCHEMA_PATH", "/app/endpoints/schema.json")
+# Other schemas are looked up as <SCHEMA_DIR>/<name>.json unless SCHEMA_PATHS maps their name to a file
+SCHEMA_DIR = os.getenv("SCHEMA_DIR", os.path.dirname(SCHEMA_PATH))
+SCHEMA_PATHS = dict(json.loads(os.getenv("SCHEMA_PATHS", "{}")), **{"default-schema": SCHEMA_PATH})
+# Seconds between checks of a schema file's modification time
+SCHEMA_RELOAD_INTERVAL = float(os.getenv("SCHEMA_RELOAD_INTERVAL", 5))
+SCHEMA_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class CompiledSchema:
+    """A schema file with what scoring needs precomputed: topics, their prompt text and a scores model."""
+
+    def __init__(self, name: str, path: str, mtime: float, text: str):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.raw = json.loads(text)
+        self.version = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+        self.topics: List[str] = list(self.raw.get("topics", []))
+        # Rendered into the score prompts' {topics} field, one topic per line
+        self.topics_prompt = "\n".join(f"        - {topic}" for topic in self.topics).lstrip()
+        # Topic names aren't identifiers, so each field takes its topic name as alias
+        self.scores_model = create_model(
+            f"Scores_{self.version}",
+            **{f"topic_{index}": (conint(ge=0, le=1), Field(..., alias=topic)) for index, topic in enumerate(self.topics)}
+        )
+        # Fast-path cosine thresholds fitted for this schema; the scorer's defaults apply without them
+        self.embedding_thresholds: Dict[str, float] = dict(self.raw.get("embedding_thresholds", {}))
+        self.topic_vectors = None  # Filled in by topic_matrix() when the embedding fast path is used
+        self.lock = threading.Lock()
+
+    @property
+    def scope(self) -> str:
+        """Key for results scored against this version of the schema."""
+        return f"{self.name}@{self.version}"
+
+    def clean_scores(self, scores: Dict[str, int]) -> Dict[str, int]:
+        """The scores for this schema's topics only; raises ValidationError if any is missing or out of range."""
+        return self.scores_model.parse_obj(scores).dict(by_alias=True)
+
+    def require_scores(self, output):
+        """acall_tool validator for score outputs: coverage errors go to the model's repair turn."""
+        self.clean_scores(output.scores)
+
+    def partial_scores(self, scores: Dict[str, int]) -> Tuple[Dict[str, int], List[str]]:
+        """The valid scores for this schema's topics, and the topics that are missing or out of range."""
+        valid = {topic: scores[topic] for topic in self.topics if scores.get(topic) in (0, 1)}
+        return valid, [topic for topic in self.topics if topic not in valid]
+
+    def check(self, output) -> Optional[str]:
+        """Cascade check for score outputs: why they don't fit this schema, or None."""
+        try:
+            self.clean_scores(output.scores)
+        except ValidationError as e:
+            return f"{len(e.errors())} of {len(self.topics)} topic scores missing or invalid"
+        return None
+
+    def topic_matrix(self, scorer):
+        with self.lock:
+            if self.topic_vectors is None:
+                self.topic_vectors = scorer.embed_topics(self.topics)
+            return self.topic_vectors
+
+class SchemaRegistry:
+    def __init__(self, paths: Dict[str, str] = SCHEMA_PATHS, schema_dir: str = SCHEMA_DIR,
+                 reload_interval: float = SCHEMA_RELOAD_INTERVAL):
+        self.paths = paths
+        self.schema_dir = schema_dir
+        self.reload_interval = reload_interval
+        self.schemas: Dict[str, CompiledSchema] = {}
+        self.checked_at: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.loads = 0
+
+    def path_of(self, name: str) -> str:
+        if name in self.paths:
+            return self.paths[name]
+        if not SCHEMA_NAME.match(name):
+            raise KeyError(name)
+        return os.path.join(self.schema_dir, f"{name}.json")
+
+    def get(self, name: str = "default-schema") -> CompiledSchema:
+        """The compiled schema called `name`; raises KeyError if there is no such schema file."""
+        now = time.monotonic()
+        with self.lock:
+            schema = self.schemas.get(name)
+            if schema is not None and now - self.checked_at[name] < self.reload_interval:
+                return schema
+            path = self.path_of(name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except FileNotFoundError:
+                if schema is not None:
+                    logger.warning(f"Schema file {path} is gone, keeping {schema.scope}")
+                    self.checked_at[name] = now
+                    return schema
+                raise KeyError(name)
+            self.checked_at[name] = now
+            if schema is not None and schema.mtime == mtime:
+                return schema
+            try:
+                with open(path, "r") as file:
+                    compiled = CompiledSchema(name, path, mtime, file.read())
+            except ValueError as e:
+                # Half-written or invalid edits don't take a working schema down
+                if schema is None:
+                    raise
+                logger.error(f"Schema file {path} is invalid, keeping {schema.scope}: {str(e)}")
+                return schema
+            schema = compiled
+            self.schemas[name] = schema
+            self.loads += 1
+            logger.info(f"Schema {schema.scope} loaded from {path} with {len(schema.topics)} topics")
+            return schema
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "loads": self.loads,
+                "schemas": {name: {"version": schema.version, "topics": len(schema.topics)} for name, schema in self.schemas.items()}
+            }
+
+_schema_registry: Optional[SchemaRegistry] = None
+
+def get_schema_registry() -> SchemaRegistry:
+    global _schema_registry
+    if _schema_registry is None:
+        _schema_registry = SchemaRegistry()
+    return _schema_registry
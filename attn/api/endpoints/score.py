@@ -1,8 +1,10 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 import logging
 import json
+import asyncio
 from datetime import datetime
 import sys
 import os
@@ -16,11 +18,16 @@ app_image = (
     Image.debian_slim(python_version="3.10")
     .pip_install(
         "requests",
-        "anthropic"
+        "anthropic",
+        "numpy",
+        "llama-index",
+        "llama-index-embeddings-huggingface",
+        "sentence-transformers",
+        "torch"
     )
 )
 
-app = App(name="score-svc", image=app_image, secrets=[Secret.from_name("my-anthropic-secret")])
+app = App(name="score-svc", image=app_image, secrets=[Secret.from_name("my-anthropic-secret"), Secret.from_name("my-huggingface-secret")])
 
 class ArticleData(BaseModel):
     url: str
@@ -34,22 +41,48 @@ class ArticleData(BaseModel):
 
 class ScoreRequest(BaseModel):
     articles: List[ArticleData]
-    schema_name: str = "default-schema"  # Default schema to use for scoring
+    schema_name: str = "default-schema"  # Scoring profile: schema.json, or <name>.json next to it
+    max_concurrency: int = 8  # Articles scored at the same time
+    stream: bool = False  # Stream NDJSON scores as each article finishes instead of one list in input order
+    batch: bool = False  # Score several articles per LLM call
+    batch_size: int = 10  # Most articles in one batched call
+    batch_token_budget: int = 8000  # Estimated prompt tokens of article text per batched call
+    cascade: bool = False  # Start with the fastest model and escalate only when topics go unscored
+    fast_path: bool = False  # Score clear-cut articles from embeddings; only borderline ones go to the LLM
+    force_refresh: bool = False  # Rescore every article instead of reusing results for unchanged ones
 
 class ScoreResponse(BaseModel):
     url: str
     scores: Dict[str, int]
+    error: Optional[str] = None  # Set when some topics are still unscored; `scores` holds the rest
 
-def load_schema(schema_path: str) -> Dict:
+def get_schema(name: str):
+    from schema_registry import get_schema_registry
     try:
-        with open(schema_path, 'r') as file:
-            logger.info(f"Schema loaded from {schema_path}")
-            schema = json.load(file)
-            return schema
+        return get_schema_registry().get(name)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown schema: {name}")
     except Exception as e:
-        logger.error(f"Error loading schema from {schema_path}: {str(e)}")
+        logger.error(f"Error loading schema {name}: {str(e)}")
         raise HTTPException(status_code=500, detail="Schema loading error")
 
+def result_keys(articles: List[ArticleData], schema, models: str) -> Dict[str, str]:
+    """Score store keys by article URL; stored scores are reused only while none of their inputs changed."""
+    from score_store import content_hash, result_key
+    from prompts import prompt_version
+    version = prompt_version("score_article") + prompt_version("score_articles_batch")
+    return {article.url: result_key(article.url, content_hash(article), schema.scope, models, version) for article in articles}
+
+def stored_scores(store, keys: Dict[str, str], articles: List[ArticleData], refresh: bool = False) -> Dict[str, ScoreResponse]:
+    if store is None:
+        return {}
+    results = {}
+    for article in articles:
+        stored = store.get("score", keys[article.url], refresh=refresh)
+        if stored is not None:
+            results[article.url] = ScoreResponse(url=article.url, scores=json.loads(stored))
+    return results
+
 @app.function(mounts=[
     Mount.from_local_dir(
         local_path="/Users/erniesg/code/erniesg/shareshare/attn/api/endpoints",
@@ -66,70 +99,252 @@ async def score(request: ScoreRequest):
     logger.info(f"Files in the /app/endpoints directory: {os.listdir('/app/endpoints')}")
     logger.info(f"Files and directories in the current working directory: {os.listdir('.')}")
 
+    if not request.articles:
+        raise HTTPException(status_code=400, detail="No articles provided")
+
+    # Resolved here so an unknown schema is a 400, not an error after the stream's 200 headers
+    get_schema(request.schema_name)
+
+    if request.stream:
+        async def score_stream():
+            async for score_response in iter_article_scores(request):
+                yield score_response.json() + "\n"
+        return StreamingResponse(score_stream(), media_type="application/x-ndjson")
+
     scores = await score_articles(request)
     return {"scores": scores}
 
+@app.function(mounts=[
+    Mount.from_local_dir(
+        local_path="/Users/erniesg/code/erniesg/shareshare/attn/api/endpoints",
+        remote_path="/app/endpoints",
+        condition=lambda pth: "score.py" not in pth,
+        recursive=True
+    )
+])
+@web_endpoint(method="GET")
+async def score_stats():
+    sys.path.insert(0, '/app')
+    sys.path.insert(0, '/app/endpoints')
+    from canonical import get_dedup_index
+    from llm_handler import get_llm_handler
+    from topic_scorer import get_topic_scorer
+    from schema_registry import get_schema_registry
+    from score_store import get_score_store
+    store = get_score_store()
+    return {
+        "dedup_index": get_dedup_index("score").stats(),
+        "store": store.stats() if store is not None else None,
+        "schemas": get_schema_registry().stats(),
+        "llm": get_llm_handler().metrics(),
+        "fast_path": get_topic_scorer().stats()
+    }
+
 async def score_articles(request: ScoreRequest, model_name: str = "claude-3-haiku-20240307"):
-    from llm_handler import LLMHandler
-    from prompts import get_prompts
-    llm_handler = LLMHandler()
+    # Scores come back in input order; use iter_article_scores to get them as they finish
+    return [score async for score in iter_article_scores(request, model_name, preserve_order=True)]
+
+async def score_articles_offline(request: ScoreRequest, model_name: str = "claude-3-haiku-20240307"):
+    """Score every article through the Message Batches API; for backfills that can wait hours for lower cost."""
+    from llm_handler import get_llm_handler
+    from canonical import dedupe_by_url
+    from batches import run_tool_batch
+    from score_store import get_score_store
+
+    schema = get_schema(request.schema_name)
+    articles = dedupe_by_url(request.articles)
+    store = get_score_store()
+    keys = result_keys(articles, schema, model_name)
+    previous = stored_scores(store, keys, articles, refresh=request.force_refresh)
+    outputs = await run_tool_batch(
+        get_llm_handler(), "score_article", request,
+        {
+            article.url: dict(
+                url=article.url,
+                title=article.title,
+                keywords=",".join(article.keywords),
+                description=article.description,
+                content=article.content,
+                topics=schema.topics_prompt
+            )
+            for article in articles if article.url not in previous
+        },
+        model_name=model_name
+    )
+    scored = dict(previous)
+    for url, output in outputs.items():
+        if output is not None and schema.check(output) is None:
+            scored[url] = ScoreResponse(url=url, scores=schema.clean_scores(output.scores))
+            if store is not None:
+                store.put("score", keys[url], url, json.dumps(scored[url].scores))
+    return [scored[article.url] for article in articles if article.url in scored]
+
+async def iter_article_scores(request: ScoreRequest, model_name: str = "claude-3-haiku-20240307", preserve_order: bool = False):
+    from llm_handler import get_llm_handler
+    from prompts import get_template
+    from canonical import canonicalize_url, dedupe_by_url, get_dedup_index
+    from fanout import fan_out
+    from batching import pack_batches, render_articles, require_results, results_by_url
+    from rate_limiter import estimate_tokens
+    from score_store import get_score_store
+    llm_handler = get_llm_handler()
 
     if not request.articles:
         raise HTTPException(status_code=400, detail="No articles provided")
 
-    schema = load_schema('/app/endpoints/schema.json')
-    topics = schema.get("topics", [])
-    logger.info(f"score.py - Topics loaded: {topics}")
+    # Score each article once, however many URL variants of it were sent
+    articles = dedupe_by_url(request.articles)
+    try:
+        get_template("score_article")
+    except KeyError:
+        logger.error("Prompt configuration for 'score_article' not found.")
+        raise HTTPException(status_code=500, detail="Configuration error")
 
-    all_scores = []  # List to collect scores from all articles
+    recent = get_dedup_index("score")
 
-    # Iterate over each article in the request
-    for article in request.articles:
-        logger.info(f"Scoring article with URL: {article.url}")
+    schema = get_schema(request.schema_name)
+    topics = schema.topics
+
+    # Articles scored before with the same content, schema, models and prompts keep their stored scores
+    store = get_score_store()
+    models = ",".join(llm_handler.cascade_models) if request.cascade else model_name
+    if request.fast_path:
+        models = f"embedding+{models}"
+    keys = result_keys(articles, schema, models)
+    previous = stored_scores(store, keys, articles, refresh=request.force_refresh)
+    if previous:
+        logger.info(f"Reusing stored scores for {len(previous)} of {len(articles)} unchanged articles")
+
+    # Recent results are scoped by the same key as stored ones, so another configuration never gets them
+    def remember(article: ArticleData, score_response: ScoreResponse):
+        recent.put(article.url, score_response, keys[article.url])
+        if store is not None:
+            store.put("score", keys[article.url], article.url, json.dumps(score_response.scores))
+
+    fast = {}  # Embedding scores, filled in below when the fast path is on
+
+    def known(article: ArticleData):
+        if article.url in previous:
+            return previous[article.url]
+        if not request.force_refresh:
+            cached = recent.get(article.url, keys[article.url])
+            if cached is not None:
+                return cached
+        return fast.get(article.url)
+
+    # Embedding scores for the articles that aren't borderline; the rest are left to the LLM
+    if request.fast_path:
+        from topic_scorer import get_topic_scorer
+        todo = [article for article in articles if known(article) is None]
         try:
-            system_prompt, message_prompt = get_prompts(
-                "score_article", request,
-                url=article.url,
-                title=article.title,
-                keywords=article.keywords,
-                description=article.description,
-                content=article.content,
-                topics=topics
+            scorer = get_topic_scorer()
+            confident, _ = await asyncio.to_thread(
+                lambda: scorer.score(todo, topics, schema.topic_matrix(scorer), **schema.embedding_thresholds)
             )
-            logger.debug(f"System prompt: {system_prompt}")
-            logger.debug(f"Message prompt: {message_prompt}")
-        except KeyError:
-            logger.error("Prompt configuration for 'score_article' not found.")
-            raise HTTPException(status_code=500, detail="Configuration error")
+            fast = {url: ScoreResponse(url=url, scores=scores) for url, scores in confident.items()}
+            if store is not None:
+                for article in todo:
+                    if article.url in fast:
+                        store.put("score", keys[article.url], article.url, json.dumps(fast[article.url].scores))
+        except Exception as e:
+            logger.error(f"Embedding scores failed, scoring every article with the LLM: {str(e)}")
 
+    async def score_one(article: ArticleData):
+        cached = known(article)
+        if cached is not None:
+            logger.info(f"Reusing known scores for article with URL: {article.url}")
+            return cached
+
+        logger.info(f"Scoring article with URL: {article.url}")
         # Call the LLM and handle the response for each article
         try:
             logger.info(f"score.py - Preparing to call LLM for article with URL: {article.url}")
-            response_text = llm_handler.call_llm(
+            output = await llm_handler.acall_tool_cascade(
                 "score_article",
                 request,
-                model_name=model_name,
+                models=None if request.cascade else [model_name],
+                refresh=request.force_refresh,
+                validator=schema.require_scores,
                 url=article.url,
                 title=article.title,
                 keywords=",".join(article.keywords),
                 description=article.description,
                 content=article.content,
-                topics=topics  # Add topics here
+                topics=schema.topics_prompt
             )
-            score_data = parse_scores_from_response(response_text)
-            all_scores.append(ScoreResponse(url=article.url, scores=score_data))
+            scores, unscored = schema.partial_scores(output.scores)
+            if unscored:
+                # Best effort after every model and repair turn; returned but not remembered
+                logger.warning(f"Article {article.url} is missing scores for {len(unscored)} topics")
+                return ScoreResponse(url=article.url, scores=scores, error=f"Unscored topics: {', '.join(unscored)}")
+            score_response = ScoreResponse(url=article.url, scores=scores)
+            remember(article, score_response)
+            return score_response
         except Exception as e:
             logger.error(f"LLM call failed for article {article.url}: {str(e)}")
-            # Optionally continue to the next article or raise an HTTPException
-            continue  # Continue processing next articles even if one fails
+            return None  # Other articles carry on even if this one fails
 
-    return all_scores  # Return the collected scores from all articles
+    async def score_batch(batch: List[ArticleData]) -> List[ScoreResponse]:
+        # Articles with stored, recent or fast-path scores don't need a place in the batch
+        results = {article.url: known(article) for article in batch}
+        todo = [article for article in batch if results[article.url] is None]
+        if len(todo) > 1:
+            logger.info(f"Scoring {len(todo)} articles in one call, starting with URL: {todo[0].url}")
+            try:
+                # Batches climb the same model ladder as single articles, so stored keys name the right models
+                output = await llm_handler.acall_tool_cascade(
+                    "score_articles_batch",
+                    request,
+                    models=None if request.cascade else [model_name],
+                    refresh=request.force_refresh,
+                    validator=require_results(todo, schema.check),
+                    max_tokens=min(4096, 200 + len(todo) * (30 + 10 * len(topics))),
+                    articles=render_articles(todo),
+                    topics=schema.topics_prompt
+                )
+            except Exception as e:
+                # A batch that still misses articles after repair is used for the ones it covers
+                output = getattr(e, "output", None)
+                logger.error(f"Batched LLM call failed for {len(todo)} articles: {str(e)}")
+            scored = results_by_url(output.results) if output is not None else {}
+            for article in todo:
+                item = scored.get(canonicalize_url(article.url))
+                if item is not None and schema.check(item) is None:
+                    results[article.url] = ScoreResponse(url=article.url, scores=schema.clean_scores(item.scores))
+                    remember(article, results[article.url])
+        # Articles the batch missed or scored only partly go through the single-article prompt
+        missing = [article for article in batch if results[article.url] is None]
+        if missing:
+            logger.info(f"Scoring {len(missing)} articles individually after the batched call")
+            for article, result in zip(missing, await asyncio.gather(*(score_one(article) for article in missing))):
+                results[article.url] = result
+        return [results[article.url] for article in batch]
 
-def parse_scores_from_response(text: str) -> Dict[str, int]:
-    try:
-        data = json.loads(text)
-        logger.info(f"Scores parsed from response: {data}")
-        return data['scores']  # Return only the scores dictionary
-    except (json.JSONDecodeError, KeyError) as e:
-        logger.error(f"Error parsing scores from response: {str(e)}")
-        return {}
+    if request.batch:
+        batches = pack_batches(
+            articles,
+            lambda article: estimate_tokens(article.title, article.description, article.content),
+            budget=request.batch_token_budget,
+            max_items=request.batch_size
+        )
+        async for _, batch, results in fan_out(
+            batches, score_batch, max_concurrency=request.max_concurrency, preserve_order=preserve_order
+        ):
+            if isinstance(results, HTTPException):
+                raise results
+            if isinstance(results, Exception):
+                logger.error(f"Scoring failed for a batch of {len(batch)} articles: {str(results)}")
+                continue
+            for result in results:
+                if result is not None:
+                    yield result
+        return
+
+    # Articles are scored concurrently; the shared LLM handler still caps calls per process
+    async for _, article, result in fan_out(
+        articles, score_one, max_concurrency=request.max_concurrency, preserve_order=preserve_order
+    ):
+        if isinstance(result, HTTPException):
+            raise result
+        if result is not None and not isinstance(result, Exception):
+            yield result
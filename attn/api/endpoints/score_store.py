@@ -0,0 +1,117 @@
+# Durable store of per-article LLM results, keyed on everything that determines them, for incremental re-runs.
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from typing import Optional
+from canonical import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+def content_hash(article) -> str:
+    """Hash of the article fields the prompts read; a changed article gets a new hash."""
+    payload = json.dumps([article.title, article.keywords, article.description, article.content])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def result_key(url: str, content: str, schema: str, model: str, prompt_version: str) -> str:
+    """Key for one article's result: canonical URL, content hash, schema name@version, model and prompt version."""
+    payload = json.dumps([canonicalize_url(url), content, schema, model, prompt_version])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ScoreStore:
+    """Results never expire: a changed input changes the key. The least recently used are evicted past max_entries."""
+
+    def __init__(self, path: str, max_entries: int = 200000):
+        self.path = path
+        self.max_entries = max_entries
+        self.counters = defaultdict(lambda: {"hits": 0, "misses": 0, "refreshes": 0, "stores": 0})  # per task
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                task TEXT NOT NULL,
+                url TEXT NOT NULL,
+                result TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+        self._db.commit()
+        logger.info(f"Score store opened at {path} (max_entries={max_entries})")
+
+    def get(self, task: str, key: str, refresh: bool = False) -> Optional[str]:
+        """The stored result, or None on a miss or when `refresh` asks for it to be recomputed."""
+        with self._lock:
+            if refresh:
+                self.counters[task]["refreshes"] += 1
+                return None
+            row = self._db.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.counters[task]["misses"] += 1
+                return None
+            self._db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.counters[task]["hits"] += 1
+        return row[0]
+
+    def put(self, task: str, key: str, url: str, result: str):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, task, url, result, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, task, url, result, now, now)
+            )
+            self.counters[task]["stores"] += 1
+            self._evict()
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            tasks = {task: dict(counters) for task, counters in self.counters.items()}
+        for counters in tasks.values():
+            lookups = counters["hits"] + counters["misses"] + counters["refreshes"]
+            counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        hits = sum(counters["hits"] for counters in tasks.values())
+        lookups = sum(counters["hits"] + counters["misses"] + counters["refreshes"] for counters in tasks.values())
+        return {
+            "entries": entries,
+            "evictions": self.evictions,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "tasks": tasks
+        }
+
+    def _evict(self):
+        count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,)
+            )
+            self.evictions += excess
+
+_score_store: Optional[ScoreStore] = None
+
+def get_score_store() -> Optional[ScoreStore]:
+    """Process-wide store configured from the environment; None when SCORE_STORE=off.
+
+    SCORE_STORE_PATH should be on a persistent volume for results to carry over between runs.
+    """
+    global _score_store
+    if os.getenv("SCORE_STORE", "on") == "off":
+        return None
+    if _score_store is None:
+        _score_store = ScoreStore(
+            path=os.getenv("SCORE_STORE_PATH", "/tmp/attn_score_store.sqlite3"),
+            max_entries=int(os.getenv("SCORE_STORE_MAX_ENTRIES", 200000))
+        )
+    return _score_store
@@ -0,0 +1,103 @@
+# Incremental parser for text/event-stream responses from the reader service.
+import logging
+from typing import AsyncIterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+class SSEEvent(NamedTuple):
+    event: str
+    data: str
+    id: Optional[str] = None
+
+class ContentTooLarge(Exception):
+    pass
+
+class SSEParser:
+    """Turns chunks of bytes into complete SSE events without re-scanning what was already parsed."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data_lines: List[bytes] = []
+        self._event = b""
+        self._id: Optional[bytes] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        buffer = self._buffer
+        # Bytes already in the buffer are a partial line with no newline; only scan the new chunk
+        scan_from = len(buffer)
+        buffer += chunk
+        events = []
+        start = 0
+        while True:
+            newline = buffer.find(b"\n", scan_from)
+            if newline < 0:
+                break
+            line = bytes(buffer[start:newline])
+            start = scan_from = newline + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        # Drop consumed lines once per chunk rather than once per line
+        del buffer[:start]
+        return events
+
+    def close(self) -> List[SSEEvent]:
+        """Flush a trailing event that was not terminated by a blank line."""
+        events = []
+        if self._buffer:
+            event = self._process_line(bytes(self._buffer).rstrip(b"\r"))
+            self._buffer.clear()
+            if event is not None:
+                events.append(event)
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _process_line(self, line: bytes) -> Optional[SSEEvent]:
+        if not line:
+            return self._dispatch()
+        if line.startswith(b":"):
+            return None  # Comment / keep-alive
+        field, _, value = line.partition(b":")
+        if value.startswith(b" "):
+            value = value[1:]
+        if field == b"data":
+            self._data_lines.append(value)
+        elif field == b"event":
+            self._event = value
+        elif field == b"id":
+            self._id = value
+        return None
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        if not self._data_lines:
+            self._event = b""
+            return None
+        event = SSEEvent(
+            event=self._event.decode("utf-8", errors="replace") or "message",
+            data=b"\n".join(self._data_lines).decode("utf-8", errors="replace"),
+            id=self._id.decode("utf-8", errors="replace") if self._id is not None else None
+        )
+        self._data_lines = []
+        self._event = b""
+        return event
+
+async def iter_sse_events(byte_stream: AsyncIterator[bytes], max_bytes: Optional[int] = None) -> AsyncIterator[SSEEvent]:
+    """Yield events as soon as their bytes arrive; raise ContentTooLarge past `max_bytes`.
+
+    Callers that have what they need can simply stop iterating; closing the response then
+    abandons the rest of the stream.
+    """
+    parser = SSEParser()
+    received = 0
+    async for chunk in byte_stream:
+        received += len(chunk)
+        if max_bytes is not None and received > max_bytes:
+            raise ContentTooLarge(f"Stream exceeded {max_bytes} bytes")
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
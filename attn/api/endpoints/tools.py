@@ -1,4 +1,6 @@
 # tools.py
+from typing import Dict, List
+from pydantic import BaseModel
 
 tools = [
     {
@@ -16,7 +18,8 @@ tools = [
                         "properties": {
                             "type": {"type": "string", "description": "Type of entity"},
                             "value": {"type": "string", "description": "Entity value"}
-                        }
+                        },
+                        "required": ["type", "value"]
                     },
                     "description": "Array of entities with type and value"
                 },
@@ -29,7 +32,8 @@ tools = [
                         "properties": {
                             "type": {"type": "string", "description": "Type of assertion"},
                             "value": {"type": "string", "description": "Assertion value"}
-                        }
+                        },
+                        "required": ["type", "value"]
                     },
                     "description": "Array of assertions with type and value"
                 },
@@ -40,22 +44,132 @@ tools = [
     },
     {
         "name": "score_article",
-        "description": "Scores the article content based on predefined topics.",
+        "description": "Records the article's score for each of the requested topics.",
         "input_schema": {
             "type": "object",
             "properties": {
                 "url": {"type": "string", "description": "URL of the article"},
-                "title": {"type": "string", "description": "Title of the article"},
-                "keywords": {"type": "array", "items": {"type": "string"}, "description": "Keywords associated with the article"},
-                "description": {"type": "string", "description": "Description of the article"},
-                "content": {"type": "string", "description": "Content of the article"},
-                "topics": {
+                "scores": {
+                    "type": "object",
+                    "additionalProperties": {"type": "integer"},
+                    "description": "Score for every requested topic, keyed by the topic name exactly as given"
+                }
+            },
+            "required": ["url", "scores"]
+        }
+    },
+    {
+        "name": "list_urls",
+        "description": "Records a list of URLs, most relevant first.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "urls": {
                     "type": "array",
-                    "items": {"type": "string"},
-                    "description": "List of topics to score the article on"
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "url": {"type": "string", "description": "Absolute URL"}
+                        },
+                        "required": ["url"]
+                    }
                 }
             },
-            "required": ["url", "title", "keywords", "description", "content", "topics"]
+            "required": ["urls"]
         }
     }
 ]
+
+def batch_tool(name: str, description: str, item_tool: dict) -> dict:
+    """A tool returning a list of item_tool inputs, each tagged with the URL of its article."""
+    item_schema = dict(item_tool["input_schema"])
+    item_schema["properties"] = dict(item_schema["properties"], url={"type": "string", "description": "URL of the article"})
+    item_schema["required"] = ["url"] + [field for field in item_schema["required"] if field != "url"]
+    return {
+        "name": name,
+        "description": description,
+        "input_schema": {
+            "type": "object",
+            "properties": {"results": {"type": "array", "items": item_schema}},
+            "required": ["results"]
+        }
+    }
+
+tools += [
+    batch_tool("extract_structures", "Extracts structured information from each article.", tools[0]),
+    batch_tool("score_articles", "Records each article's score for each of the requested topics.", tools[1])
+]
+
+class TypedValue(BaseModel):
+    type: str
+    value: str
+
+class StructureOutput(BaseModel):
+    author: str
+    published_date: str
+    entities: List[TypedValue]
+    location: str
+    main_idea: str
+    assertions: List[TypedValue]
+    summary: str
+
+class ScoreOutput(BaseModel):
+    url: str = ""
+    scores: Dict[str, int]
+
+class StructureBatchItem(StructureOutput):
+    url: str
+
+class StructureBatchOutput(BaseModel):
+    results: List[StructureBatchItem]
+
+class ScoreBatchItem(ScoreOutput):
+    url: str
+
+class ScoreBatchOutput(BaseModel):
+    results: List[ScoreBatchItem]
+
+class UrlItem(BaseModel):
+    url: str
+
+class UrlsOutput(BaseModel):
+    urls: List[UrlItem]
+
+# The model each tool's input is validated against
+tool_models = {
+    "extract_structure": StructureOutput,
+    "score_article": ScoreOutput,
+    "list_urls": UrlsOutput,
+    "extract_structures": StructureBatchOutput,
+    "score_articles": ScoreBatchOutput
+}
+
+# The tool each prompt in prompts.py answers with
+function_tools = {
+    "generate_urls": "list_urls",
+    "rerank_article_urls": "list_urls",
+    "extract_structure": "extract_structure",
+    "score_article": "score_article",
+    "extract_structure_batch": "extract_structures",
+    "score_articles_batch": "score_articles"
+}
+
+def get_tool(name: str) -> dict:
+    for tool in tools:
+        if tool["name"] == name:
+            return tool
+    raise KeyError(name)
+
+# Cascade checks: each returns why an output is not good enough, or None to accept it
+
+def require_urls(count: int):
+    def check(output: UrlsOutput):
+        urls = {item.url for item in output.urls if item.url.startswith(("http://", "https://"))}
+        return f"{len(urls)} of {count} URLs" if len(urls) < count else None
+    return check
+
+def require_fields(*fields: str):
+    def check(output: BaseModel):
+        empty = [field for field in fields if not getattr(output, field)]
+        return f"empty {', '.join(empty)}" if empty else None
+    return check
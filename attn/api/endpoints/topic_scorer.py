@@ -0,0 +1,103 @@
+# Fast-path topic scoring from embeddings: clear-cut articles are scored without an LLM call.
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Absolute cosine thresholds, so an article's real similarity to a topic decides, not its rank among
+# the article's topics. They depend on the embedding model; a schema can carry its own pair, fitted
+# against LLM-labelled articles, as "embedding_thresholds": {"high": ..., "low": ...}.
+EMBED_SCORE_HIGH = float(os.getenv("EMBED_SCORE_HIGH", 0.75))  # Cosine at or above which a topic scores 1
+EMBED_SCORE_LOW = float(os.getenv("EMBED_SCORE_LOW", 0.55))  # Cosine at or below which a topic scores 0
+EMBED_MAX_CHARS = int(os.getenv("EMBED_MAX_CHARS", 2000))  # Article text embedded, from the start
+
+def article_text(article, max_chars: int = EMBED_MAX_CHARS) -> str:
+    text = "\n".join(part for part in (article.title, ", ".join(article.keywords), article.description, article.content) if part)
+    return text[:max_chars]
+
+def normalize(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def calibrate(similarities: np.ndarray, high: float = EMBED_SCORE_HIGH, low: float = EMBED_SCORE_LOW) -> Tuple[np.ndarray, np.ndarray]:
+    """Map an articles x topics cosine matrix to 0/1 scores and a per-article borderline flag.
+
+    A topic scores 1 when its cosine is at least `high` and 0 when it is at most `low`. An article
+    with any topic in between is borderline; an article unrelated to every topic scores all 0.
+    """
+    scores = (similarities >= high).astype(int)
+    borderline = ((similarities > low) & (similarities < high)).any(axis=1)
+    return scores, borderline
+
+class TopicScorer:
+    """Scores articles against topics by cosine similarity; callers keep the topic embeddings between calls."""
+
+    def __init__(self, embed: Callable[[List[str]], Tuple[List[List[float]], str]], high: float = EMBED_SCORE_HIGH,
+                 low: float = EMBED_SCORE_LOW, max_chars: int = EMBED_MAX_CHARS):
+        self.embed = embed  # texts -> (embeddings, model), e.g. EmbeddingHandler.generate_embeddings
+        self.high = high
+        self.low = low
+        self.max_chars = max_chars
+        self.lock = threading.Lock()
+        self.scored = 0
+        self.borderline = 0
+
+    def embed_topics(self, topics: Sequence[str]) -> np.ndarray:
+        embeddings, model = self.embed(list(topics))
+        logger.info(f"Embedded {len(topics)} topics with {model}")
+        return normalize(embeddings)
+
+    def score(self, articles: Sequence, topics: Sequence[str], topic_matrix: Optional[np.ndarray] = None,
+              high: Optional[float] = None, low: Optional[float] = None) -> Tuple[Dict[str, Dict[str, int]], List[str]]:
+        """Returns (scores by URL for clear-cut articles, URLs of borderline articles for the LLM).
+
+        `topic_matrix` is embed_topics(topics) from an earlier call; it is computed here if not given.
+        `high` and `low` override the scorer's thresholds, e.g. with a schema's fitted ones.
+        """
+        if not articles or not topics:
+            return {}, [article.url for article in articles]
+        started = time.monotonic()
+        if topic_matrix is None:
+            topic_matrix = self.embed_topics(topics)
+        embeddings, _ = self.embed([article_text(article, self.max_chars) for article in articles])
+        similarities = normalize(embeddings) @ topic_matrix.T
+        scores, borderline = calibrate(similarities, high if high is not None else self.high, low if low is not None else self.low)
+
+        confident, uncertain = {}, []
+        for article, row, unsure in zip(articles, scores, borderline):
+            if unsure:
+                uncertain.append(article.url)
+            else:
+                confident[article.url] = {topic: int(score) for topic, score in zip(topics, row)}
+        with self.lock:
+            self.scored += len(articles)
+            self.borderline += len(uncertain)
+        logger.info(
+            f"Embedding scores for {len(articles)} articles in {time.monotonic() - started:.2f}s; "
+            f"{len(uncertain)} borderline"
+        )
+        return confident, uncertain
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "scored": self.scored,
+                "borderline": self.borderline,
+                "fast_path_rate": (self.scored - self.borderline) / self.scored if self.scored else 0.0
+            }
+
+_topic_scorer: Optional[TopicScorer] = None
+
+def get_topic_scorer() -> TopicScorer:
+    global _topic_scorer
+    if _topic_scorer is None:
+        from embedding_handler import get_embedding_handler
+        handler = get_embedding_handler()
+        model = os.getenv("EMBED_SCORE_MODEL") or handler.default_model
+        _topic_scorer = TopicScorer(lambda texts: handler.generate_embeddings(texts, model))
+    return _topic_scorer